@@ -0,0 +1,109 @@
+"""Compare storing the articles of a refresh one feed at a time, as
+feedmailer used to through a temporary table, with storing every feed's
+articles in a single transaction.
+
+    python -m benchmarks.bulk_refresh [feeds] [entries]
+
+Each approach is timed on an empty database and again when all but a
+few of the articles are already known, which is the common case.
+"""
+import os
+import sys
+import tempfile
+import time
+
+from feedmailer import crud, database
+
+
+# The per feed refresh feedmailer used before articles of every feed
+# were stored together, kept here for comparison
+def refresh_articles_per_feed(conn, feed_id: int, articles) -> int:
+    cur = conn.cursor()
+
+    cur.execute(
+        "UPDATE feeds SET refreshed_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP WHERE feed_id = ?;", (feed_id,))
+    cur.execute("CREATE TEMP TABLE temp_articles (url VARCHAR NOT NULL, title VARCHAR NOT NULL, "
+                "author VARCHAR NULL, feed_id INTEGER NOT NULL, description TEXT NULL, published_at DATETIME);")
+    cur.executemany(
+        "INSERT INTO temp_articles (url, title, author, feed_id, description, published_at) VALUES (?, ?, ?, ?, ?, ?);",
+        [(a['url'], a['title'], a['author'], feed_id, a['description'], a['published_at']) for a in articles])
+    cur.execute("INSERT INTO articles (url, title, author, feed_id, description, published_at, created_at) "
+                "SELECT t.url, t.title, t.author, t.feed_id, t.description, DATETIME(t.published_at, 'UTC'), CURRENT_TIMESTAMP "
+                "FROM temp_articles AS t LEFT JOIN articles AS a ON t.feed_id = a.feed_id AND t.url = a.url "
+                "WHERE a.article_id IS NULL;")
+    conn.commit()
+
+    num_merged = cur.rowcount
+
+    cur.execute("DROP TABLE temp_articles;")
+    conn.commit()
+    cur.close()
+
+    return num_merged
+
+
+def refresh_per_feed(conn, articles_by_feed) -> int:
+    return sum(refresh_articles_per_feed(conn, feed_id, articles)
+               for feed_id, articles in articles_by_feed.items())
+
+
+def refresh_bulk(conn, articles_by_feed) -> int:
+    return sum(crud.refresh_articles_bulk(conn, articles_by_feed).values())
+
+
+def synthetic_articles(num_feeds: int, num_entries: int, offset: int = 0):
+    return {
+        feed_id: [{
+            'url': f"https://example.com/{feed_id}/{i}",
+            'title': f"Article {i}",
+            'author': 'author@example.com',
+            'description': 'description ' * 40,
+            'published_at': '2024-01-01 00:00:00',
+            'guid': f"example.com/{feed_id}/{i}"
+        } for i in range(offset, offset + num_entries)]
+        for feed_id in range(1, num_feeds + 1)
+    }
+
+
+def run(name: str, refresh, path: str, num_feeds: int, num_entries: int):
+    conn = database.connect(path)
+    database.setup_db(conn)
+    conn.executemany(
+        "INSERT INTO feeds(feed_id, title, url, created_at) VALUES (?, ?, ?, CURRENT_TIMESTAMP);",
+        ((i, f"Feed {i}", f"https://example.com/{i}.xml") for i in range(1, num_feeds + 1)))
+    conn.commit()
+
+    commits = 0
+
+    def count_commits(statement: str):
+        nonlocal commits
+        if statement.strip().upper().startswith('COMMIT'):
+            commits += 1
+
+    conn.set_trace_callback(count_commits)
+
+    # a cold refresh, then one where a few articles were published since
+    for label, articles in (('empty', synthetic_articles(num_feeds, num_entries)),
+                            ('mostly known', synthetic_articles(num_feeds, num_entries, 3))):
+        commits = 0
+        started = time.perf_counter()
+        added = refresh(conn, articles)
+        elapsed = time.perf_counter() - started
+
+        print(f"{name:<9} {label:<13} {added:>7} added  {elapsed:>7.3f}s  "
+              f"{commits:>5} commits  {commits / elapsed:>8.0f} commits/s")
+
+    conn.close()
+
+
+def main():
+    num_feeds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    num_entries = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    with tempfile.TemporaryDirectory() as tmp:
+        run('per feed', refresh_per_feed, os.path.join(tmp, 'per_feed.db'), num_feeds, num_entries)
+        run('bulk', refresh_bulk, os.path.join(tmp, 'bulk.db'), num_feeds, num_entries)
+
+
+if __name__ == '__main__':
+    main()
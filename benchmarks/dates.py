@@ -0,0 +1,120 @@
+"""Compare parsing the publish dates of entries with dateutil, as
+feedmailer used to, against feedparser's parsed dates and the fast
+RFC 822 and ISO 8601 parsers of feedmailer.dates.
+
+    python -m benchmarks.dates [entries]
+
+A feed with the dates below is parsed with feedparser and every date is
+checked to be stored as the same moment both ways. Zones such as EST are
+unknown to dateutil, which leaves their dates naive, while feedparser
+applies them. These are reported as fixed rather than as differences.
+Exits with a non-zero status when any other date differs.
+"""
+from datetime import timezone
+import sys
+import time
+
+import feedparser
+from dateutil import parser
+
+from feedmailer import dates
+
+# formats found in real feeds
+CORPUS = [
+    'Mon, 01 Jan 2024 10:00:00 +0000',
+    'Mon, 01 Jan 2024 10:00:00 -0000',
+    'Tue, 02 Jan 2024 23:59:59 +0200',
+    'Wed, 3 Jan 2024 08:05:00 -0500',
+    'Thu, 04 Jan 2024 12:00:00 GMT',
+    'Fri, 05 Jan 2024 12:00:00 UT',
+    'Sat, 06 Jan 2024 12:00 +0100',
+    '07 Jan 2024 07:30:00 +0000',
+    'Mon, 08 Jan 2024 09:00:00 EST',
+    'Tue, 09 Jan 2024 09:00:00 PDT',
+    'Wed, 10 Jan 2024 00:00:00 CET',
+    '2024-01-11T10:00:00Z',
+    '2024-01-12T10:00:00+05:30',
+    '2024-01-13T10:00:00.123456-08:00',
+    '2024-01-14 10:00:00',
+    '2024-01-15T10:00:00',
+    '2024-01-16',
+    '2024-01-17T10:00:00+0100',
+    'January 18, 2024',
+    'Friday, January 19, 2024 - 10:00',
+    '20/01/2024 10:00',
+]
+
+
+def make_feed(num_entries: int) -> str:
+    items = ''.join(f"<item><title>Article {i}</title><link>https://example.com/{i}</link>"
+                    f"<pubDate>{CORPUS[i % len(CORPUS)]}</pubDate></item>"
+                    for i in range(num_entries))
+
+    return f'<?xml version="1.0"?><rss version="2.0"><channel><title>Feed</title>{items}</channel></rss>'
+
+
+# The moment a date is stored as. Naive dates are stored as they are,
+# which is utc on a server running in utc, and sqlite's DATETIME drops
+# fractions of seconds.
+def stored_as(value):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+
+    return value.astimezone(timezone.utc).replace(microsecond=0)
+
+
+def ignores_zone(value: str, parsed) -> bool:
+    return parsed.tzinfo is None and value.split()[-1].isalpha()
+
+
+def run(label: str, entries, parse) -> float:
+    started = time.perf_counter()
+
+    for entry in entries:
+        parse(entry)
+
+    elapsed = time.perf_counter() - started
+    print(f"{label:<28} {elapsed:>7.3f}s  {len(entries) / elapsed:>10.0f} dates/s")
+
+    return elapsed
+
+
+def main():
+    num_entries = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    entries = feedparser.parse(make_feed(num_entries)).entries
+
+    mismatches = 0
+
+    for value, entry in zip(CORPUS, entries):
+        expected = parser.parse(value)
+        strings = dates.parse_date.__wrapped__(value)
+        published = dates.entry_published(entry)
+
+        if stored_as(expected) == stored_as(strings) == stored_as(published):
+            status = 'ok'
+        elif ignores_zone(value, expected) and stored_as(expected) == stored_as(strings):
+            status = 'fixed'
+        else:
+            status = 'MISMATCH'
+            mismatches += 1
+
+        print(f"{value:<36} {status:<8} {stored_as(published).isoformat()}")
+
+    print(f"\n{num_entries} entries")
+    uncached = run('dateutil', entries, lambda e: parser.parse(e.published))
+    run('fast parsers', entries, lambda e: dates.parse_date.__wrapped__(e.published))
+
+    dates.parse_date.cache_clear()
+    run('fast parsers, remembered', entries, lambda e: dates.parse_date(e.published))
+    fast = run('entry_published', entries, dates.entry_published)
+
+    print(f"{'speedup':<28} {uncached / fast:>7.1f}x")
+
+    if mismatches:
+        print(f"{mismatches} dates differ from dateutil")
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
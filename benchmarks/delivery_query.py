@@ -0,0 +1,121 @@
+"""Check the query plans of the delivery and dedup queries use their
+indexes, then time finding articles for delivery in a database with
+millions of articles.
+
+    python -m benchmarks.delivery_query [--articles 2000000] [--feeds 200]
+
+Exits with a non-zero status when a query plan scans the articles table.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from feedmailer import crud, database
+
+# query plans which must not fall back to scanning every article
+PLANS = {
+    'find_articles_for_delivery': (
+        "SELECT a.article_id FROM subscriptions s "
+        "INNER JOIN articles a ON s.feed_id = a.feed_id "
+        "WHERE s.subscription_id = ? AND " + crud.NOT_DELIVERED + ";",
+        (1,),
+        'articles_feed_id (feed_id=? AND rowid>?)'
+    ),
+    'delivered_elsewhere': (
+        "SELECT a.article_id FROM subscriptions s "
+        "INNER JOIN articles a ON s.feed_id = a.feed_id "
+        "WHERE s.subscription_id = ? AND " + crud.NOT_DELIVERED_ELSEWHERE + ";",
+        (1,),
+        'articles_guid'
+    ),
+    'refresh_articles': (
+        "SELECT a.article_id FROM articles a WHERE a.feed_id = ? AND a.url = ?;",
+        (1, 'https://example.com/1'),
+        'sqlite_autoindex_articles_1'
+    )
+}
+
+
+def populate(conn, num_articles: int, num_feeds: int):
+    cur = conn.cursor()
+
+    cur.executemany(
+        "INSERT INTO feeds(feed_id, title, url, created_at) VALUES (?, ?, ?, CURRENT_TIMESTAMP);",
+        ((i, f"Feed {i}", f"https://example.com/{i}.xml") for i in range(1, num_feeds + 1)))
+
+    cur.executemany(
+        "INSERT INTO subscriptions(email, feed_id, created_at) "
+        "VALUES ('user@example.com', ?, DATETIME('now', '-1 year'));",
+        ((i,) for i in range(1, num_feeds + 1)))
+
+    # articles are spread over the past year
+    cur.executemany(
+        "INSERT INTO articles(title, url, feed_id, description, published_at, guid, created_at) "
+        "VALUES (?, ?, ?, 'description', DATETIME('now', ?), ?, CURRENT_TIMESTAMP);",
+        ((f"Article {i}", f"https://example.com/{i}", i % num_feeds + 1, f"-{i % 525600} minutes", f"example.com/{i}")
+         for i in range(num_articles)))
+
+    # every subscription was delivered all but the last day's worth of
+    # articles
+    cur.execute("UPDATE subscriptions SET delivered_article_id = ?;",
+                (num_articles - num_articles // 365,))
+
+    conn.commit()
+    cur.execute("ANALYZE")
+    cur.close()
+
+
+def check_plans(conn) -> bool:
+    ok = True
+
+    for name, (query, params, index) in PLANS.items():
+        plan = [row['detail']
+                for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+        uses_index = any(index in detail for detail in plan)
+        ok = ok and uses_index
+
+        print(f"{name}: {'ok' if uses_index else 'MISSING ' + index}")
+        for detail in plan:
+            print(f"    {detail}")
+
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmarks.delivery_query')
+    parser.add_argument('--articles', type=int, default=2000000,
+                        help='Number of articles spread over the feeds')
+    parser.add_argument('--feeds', type=int, default=200,
+                        help='Number of feeds, each with one subscription')
+    args = parser.parse_args()
+
+    num_articles = args.articles
+    num_feeds = args.feeds
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = database.connect(os.path.join(tmp, 'benchmark.db'))
+        database.setup_db(conn)
+
+        started = time.perf_counter()
+        populate(conn, num_articles, num_feeds)
+        print(f"inserted {num_articles} articles in {time.perf_counter() - started:.1f}s\n")
+
+        ok = check_plans(conn)
+
+        started = time.perf_counter()
+        found = sum(len(list(crud.find_articles_for_delivery(conn, s)))
+                    for s in range(1, num_feeds + 1))
+        elapsed = time.perf_counter() - started
+
+        print(f"\nfound {found} articles for {num_feeds} subscriptions in {elapsed:.3f}s "
+              f"({elapsed / num_feeds * 1000:.2f}ms per subscription)")
+
+        conn.close()
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Compare rendering every article once per subscriber, as feedmailer
+used to, against sharing renders between subscribers of the same feed.
+
+    python -m benchmarks.render_cache [subscribers] [articles]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from feedmailer import database
+from feedmailer.commandline import DATA_DIR, TEMPLATES
+from feedmailer.mailer import Mailer, create_template_env
+from feedmailer.render_cache import RenderCache
+
+from benchmarks.templates import make_article
+
+
+def run(label: str, env, cache, subscribers: int, articles, name: str, content_type: str) -> float:
+    mailer = Mailer(host='', user='', password='', auth=False, ssl=False, port=25,
+                    templates=env, render_cache=cache)
+
+    started = time.perf_counter()
+
+    for _ in range(subscribers):
+        for article in articles:
+            mailer.render_article(feed_title='Feed', article=article, desc_length=300,
+                                  template=name, content_type=content_type)
+
+    if cache:
+        cache.save()
+
+    elapsed = time.perf_counter() - started
+    hits = f"{cache.hits:>7} hits {cache.misses:>6} misses" if cache else ''
+    print(f"{label:<24} {elapsed:>7.3f}s  {hits}")
+
+    return elapsed
+
+
+def main():
+    subscribers = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    num_articles = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    articles = [make_article(i) for i in range(num_articles)]
+    env = create_template_env(DATA_DIR)
+
+    for content_type, templates in TEMPLATES.items():
+        name = templates['article_template']
+        print(f"{name} ({subscribers} subscribers, {num_articles} articles)")
+
+        uncached = run('render per subscriber', env, None, subscribers, articles, name, content_type)
+        cached = run('shared renders', env, RenderCache(10000), subscribers, articles, name, content_type)
+
+        # a later run which finds every render in the database
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = database.connect(os.path.join(tmp, 'renders.db'))
+            database.setup_db(conn)
+            run('persisted, first run', env, RenderCache(10000, conn), subscribers, articles, name, content_type)
+            run('persisted, next run', env, RenderCache(10000, conn), subscribers, articles, name, content_type)
+            conn.close()
+
+        print(f"{'speedup':<24} {uncached / cached:>7.1f}x\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Compare the memory used loading articles for delivery the way
+feedmailer used to, fetching every row as a sqlite3.Row and copying it
+into a dataclass with a __dict__, against building slotted records
+straight from the row factory.
+
+    python -m benchmarks.row_memory [articles]
+
+Memory is traced with tracemalloc, which slows every run down, so times
+are only comparable with each other.
+"""
+import dataclasses
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from feedmailer import crud, database
+from feedmailer.types import Article
+
+# Article as it was before it used __slots__
+LegacyArticle = dataclasses.make_dataclass(
+    'LegacyArticle', [(f.name, f.type) for f in dataclasses.fields(Article)])
+
+
+# find_articles_for_delivery before records were built by the row
+# factory, kept here for comparison
+def find_articles_legacy(conn, subscription_id: int):
+    cur = conn.cursor()
+    query = ("SELECT a.article_id, a.title, a.url, a.published_at, a.author, a.description, "
+             "a.feed_id, a.category, a.created_at, a.updated_at, a.guid "
+             "FROM subscriptions s "
+             "INNER JOIN articles a ON s.feed_id = a.feed_id "
+             "WHERE s.subscription_id = ? "
+             "AND a.effective_at > COALESCE(s.attempted_delivery_at, s.created_at) "
+             "AND " + crud.NOT_DELIVERED_ELSEWHERE + ";")
+
+    cur.execute(query, (subscription_id,))
+    conn.commit()
+    rows = cur.fetchall()
+    cur.close()
+
+    return [LegacyArticle(**row) for row in rows]
+
+
+def count(articles) -> int:
+    return sum(1 for _ in articles)
+
+
+def populate(conn, num_articles: int):
+    cur = conn.cursor()
+    cur.execute("INSERT INTO feeds(feed_id, title, url, created_at) "
+                "VALUES (1, 'Feed', 'https://example.com/feed.xml', CURRENT_TIMESTAMP);")
+    cur.execute("INSERT INTO subscriptions(email, feed_id, created_at) "
+                "VALUES ('user@example.com', 1, DATETIME('now', '-2 years'));")
+    cur.executemany(
+        "INSERT INTO articles(title, url, feed_id, description, published_at, guid, created_at) "
+        "VALUES (?, ?, 1, ?, DATETIME('now', ?), ?, CURRENT_TIMESTAMP);",
+        ((f"Article {i}", f"https://example.com/{i}", 'description ' * 10,
+          f"-{i % 525600} minutes", f"example.com/{i}")
+         for i in range(num_articles)))
+    conn.commit()
+    cur.close()
+
+
+def run(label: str, load):
+    tracemalloc.start()
+    started = time.perf_counter()
+
+    result = load()
+
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    num_articles = result if isinstance(result, int) else len(result)
+    del result
+
+    print(f"{label:<28} {num_articles:>8} articles  {elapsed:>7.2f}s  {peak / 1024 / 1024:>8.1f}MB peak")
+
+
+def main():
+    num_articles = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = database.connect(os.path.join(tmp, 'benchmark.db'))
+        database.setup_db(conn)
+        populate(conn, num_articles)
+
+        run('Row + dataclass, list', lambda: find_articles_legacy(conn, 1))
+        run('slotted records, list', lambda: list(crud.find_articles_for_delivery(conn, 1)))
+        run('slotted records, iterated', lambda: count(crud.find_articles_for_delivery(conn, 1)))
+
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Run several `refresh --worker-id` processes against one database at
+the same time and check every feed is refreshed exactly once, including
+feeds left leased by a worker which died.
+
+    python -m benchmarks.sharded_refresh [--feeds 120] [--workers 1 2 4] [--delay 0.2]
+
+Feeds are served with a delay standing in for the network, and each
+worker fetches --concurrency feeds at once, so throughput should grow
+with the number of workers. Exits with a non-zero status when a feed is
+refreshed more or less than once or a lease is left behind.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.stand_ins import FeedServer
+from benchmarks.suite import add_subscriptions, write_config
+
+# feeds claimed by a worker which then died, left for the others
+ABANDONED_FEEDS = 5
+
+
+def run_workers(app_dir: str, num_workers: int, concurrency: int) -> float:
+    env = dict(os.environ, FEEDMAILER_APP_DIR=app_dir)
+    started = time.perf_counter()
+
+    processes = [subprocess.Popen(
+        [sys.executable, '-c', "from feedmailer.commandline import cli; import sys; cli(sys.argv[1:])",
+         'refresh', '--worker-id', f"worker-{n}", '--concurrency', str(concurrency)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for n in range(num_workers)]
+
+    for process in processes:
+        process.wait()
+
+    return time.perf_counter() - started
+
+
+def run(num_workers: int, args, urls) -> bool:
+    with tempfile.TemporaryDirectory() as app_dir:
+        os.environ['FEEDMAILER_APP_DIR'] = app_dir
+        write_config(app_dir, ('127.0.0.1', 25))
+
+        from feedmailer import crud, database
+
+        conn = database.connect(os.path.join(app_dir, 'feedmailer.db'))
+        database.setup_db(conn)
+        add_subscriptions(conn, urls, 1)
+
+        # a worker which claimed feeds and died before refreshing them
+        crud.claim_feeds(conn, 'crashed', ABANDONED_FEEDS, 60)
+        conn.execute(
+            "UPDATE feed_leases SET expires_at = DATETIME(CURRENT_TIMESTAMP, '-1 seconds');")
+        conn.commit()
+
+        elapsed = run_workers(app_dir, num_workers, args.concurrency)
+
+        refreshes = conn.execute(
+            "SELECT f.feed_id, COUNT(r.refresh_id) AS refreshes FROM feeds f "
+            "LEFT JOIN feed_refreshes r ON r.feed_id = f.feed_id AND r.status = 'ok' "
+            "GROUP BY f.feed_id;").fetchall()
+        leases = conn.execute(
+            "SELECT COUNT(*) AS leases FROM feed_leases;").fetchone()['leases']
+        conn.close()
+
+    wrong = [row['feed_id'] for row in refreshes if row['refreshes'] != 1]
+
+    print(f"{num_workers:>2} workers  {elapsed:>7.2f}s  {len(urls) / elapsed:>7.1f} feeds/s  "
+          f"{len(wrong):>3} feeds not refreshed once  {leases:>3} leases left")
+
+    return not wrong and not leases
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmarks.sharded_refresh')
+    parser.add_argument('--feeds', type=int, default=120,
+                        help='Number of synthetic feeds')
+    parser.add_argument('--entries', type=int, default=10,
+                        help='Number of entries per feed')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4],
+                        help='Numbers of workers to run at once')
+    parser.add_argument('--concurrency', type=int, default=2,
+                        help='Feeds fetched at once by each worker')
+    parser.add_argument('--delay', type=float, default=0.2,
+                        help='Seconds the server takes to answer each request')
+    args = parser.parse_args()
+
+    ok = True
+
+    with FeedServer(args.feeds, args.entries, args.delay) as feeds:
+        for num_workers in args.workers:
+            ok = run(num_workers, args, feeds.urls) and ok
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""Local stand-ins for the services feedmailer talks to: synthetic feeds
+served over http and an smtp server which only counts messages.
+"""
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+import http.server
+import socketserver
+import threading
+import time
+from typing import Tuple
+from xml.sax.saxutils import escape
+
+DESCRIPTION = ('<p>Lorem ipsum <b>dolor</b> sit amet, consectetur adipiscing elit. '
+               'Sed do eiusmod tempor <a href="https://example.com">incididunt</a> ut labore.</p>') * 4
+
+
+def rss_feed(name: str, entries: int, now: datetime) -> bytes:
+    items = ''.join(
+        '<item>'
+        f'<title>{name} article {i}</title>'
+        f'<link>https://example.com/{name}/{i}</link>'
+        f'<guid>https://example.com/{name}/{i}</guid>'
+        f'<author>author@example.com</author>'
+        f'<description>{escape(DESCRIPTION)}</description>'
+        f'<pubDate>{format_datetime(now - timedelta(minutes=i))}</pubDate>'
+        '</item>'
+        for i in range(entries))
+
+    return ('<?xml version="1.0" encoding="utf-8"?><rss version="2.0"><channel>'
+            f'<title>{name}</title><link>https://example.com/{name}</link>'
+            f'<description>Synthetic feed</description>{items}</channel></rss>').encode()
+
+
+def atom_feed(name: str, entries: int, now: datetime) -> bytes:
+    items = ''.join(
+        '<entry>'
+        f'<title>{name} article {i}</title>'
+        f'<id>urn:{name}:{i}</id>'
+        f'<link href="https://example.com/{name}/{i}"/>'
+        f'<author><name>Author</name></author>'
+        f'<summary type="html">{escape(DESCRIPTION)}</summary>'
+        f'<published>{(now - timedelta(minutes=i)).isoformat()}</published>'
+        f'<updated>{(now - timedelta(minutes=i)).isoformat()}</updated>'
+        '</entry>'
+        for i in range(entries))
+
+    return ('<?xml version="1.0" encoding="utf-8"?><feed xmlns="http://www.w3.org/2005/Atom">'
+            f'<title>{name}</title><id>urn:{name}</id><updated>{now.isoformat()}</updated>'
+            f'{items}</feed>').encode()
+
+
+class FeedServer():
+    """Serves `count` synthetic feeds of `entries` entries each at
+    /feed-<n>.xml, alternating between rss and atom. Responses carry an
+    ETag so conditional requests are answered with 304. Every response is
+    held back by `delay` seconds to stand in for a slow network."""
+
+    def __init__(self, count: int, entries: int, delay: float = 0.0):
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+
+        self.feeds = {}
+
+        for n in range(count):
+            render = rss_feed if n % 2 == 0 else atom_feed
+            self.feeds[f"/feed-{n}.xml"] = render(f"feed-{n}", entries, now)
+
+        feeds = self.feeds
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                time.sleep(delay)
+                body = feeds.get(self.path)
+
+                if body is None:
+                    self.send_error(404)
+                    return
+
+                etag = f'"{hash(body)}"'
+
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/xml')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True)
+
+    @property
+    def urls(self):
+        return [f"http://127.0.0.1:{self.server.server_port}{path}" for path in self.feeds]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SMTPSink():
+    """A minimal smtp server which accepts every message and counts them"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.messages = 0
+        self.connections = 0
+
+        sink = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line: str):
+                self.wfile.write(line.encode() + b'\r\n')
+
+            def handle(self):
+                with sink.lock:
+                    sink.connections += 1
+
+                self.reply('220 localhost sink')
+
+                while line := self.rfile.readline():
+                    command = line[:4].upper()
+
+                    if command in (b'EHLO', b'HELO'):
+                        self.reply('250 localhost')
+                    elif command == b'DATA':
+                        self.reply('354 end with .')
+
+                        while self.rfile.readline() not in (b'.\r\n', b''):
+                            pass
+
+                        with sink.lock:
+                            sink.messages += 1
+
+                        self.reply('250 queued')
+                    elif command == b'QUIT':
+                        self.reply('221 bye')
+                        return
+                    else:
+                        self.reply('250 ok')
+
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True)
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self.server.server_address
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,92 @@
+"""Guard the startup time of commands which only read or change the
+database. Each command is ran in a new interpreter with `-X importtime`
+against an empty FEEDMAILER_APP_DIR.
+
+    python -m benchmarks.startup [--repeat 5] [--max-ms 150]
+
+Exits with a non-zero status when one of these commands imports a heavy
+dependency, or its median run takes longer than --max-ms.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+COMMANDS = [
+    ['list'],
+    ['list-feeds'],
+    ['remove', '1']
+]
+
+# only commands which fetch feeds or send mail may import these
+HEAVY_MODULES = ('feedparser', 'html2text', 'dateutil', 'jinja2', 'smtplib', 'email.mime',
+                 'urllib.request', 'feedmailer.fetcher', 'feedmailer.mailer')
+
+
+def run_command(command, app_dir: str):
+    code = f"from feedmailer.commandline import cli; cli({command!r})"
+    env = dict(os.environ, FEEDMAILER_APP_DIR=app_dir)
+
+    started = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                             capture_output=True, text=True, env=env, check=True)
+    elapsed = time.perf_counter() - started
+
+    # lines look like "import time: self [us] | cumulative | imported package"
+    imported = {}
+
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imported[name.strip()] = int(cumulative)
+
+    return elapsed, imported
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmarks.startup')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of times each command is ran')
+    parser.add_argument('--max-ms', type=float, default=None,
+                        help='Fail when a command takes longer than this many milliseconds')
+    args = parser.parse_args()
+
+    ok = True
+
+    with tempfile.TemporaryDirectory() as app_dir:
+        # the first run creates the config and database
+        run_command(['list'], app_dir)
+
+        for command in COMMANDS:
+            runs = []
+
+            for _ in range(args.repeat):
+                elapsed, imported = run_command(command, app_dir)
+                runs.append(elapsed)
+
+            median = statistics.median(runs) * 1000
+            heavy = sorted({module for module in HEAVY_MODULES for name in imported
+                            if name == module or name.startswith(module + '.')})
+            imports_ms = imported.get('feedmailer.commandline', 0) / 1000
+
+            print(f"{' '.join(command):<12} {median:>7.1f}ms total  "
+                  f"{imports_ms:>6.1f}ms importing feedmailer.commandline")
+
+            if heavy:
+                ok = False
+                print(f"    imports {', '.join(heavy)}")
+
+            if args.max_ms and median > args.max_ms:
+                ok = False
+                print(f"    slower than {args.max_ms:g}ms")
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""Time refresh and deliver end to end against local stand-ins, using a
+temporary FEEDMAILER_APP_DIR.
+
+    python -m benchmarks.suite [--feeds 50] [--entries 100] [--output results.json]
+    python -m benchmarks.suite --compare before.json after.json
+
+Results are written as json so runs of different commits can be compared.
+"""
+import argparse
+import configparser
+import importlib
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.stand_ins import FeedServer, SMTPSink
+
+
+def measure(repeat: int, run, setup=None) -> dict:
+    runs = []
+
+    for _ in range(repeat):
+        if setup:
+            setup()
+
+        started = time.perf_counter()
+        run()
+        runs.append(time.perf_counter() - started)
+
+    return {'median': statistics.median(runs), 'min': min(runs), 'runs': runs}
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_config(app_dir: str, smtp_address):
+    config = configparser.ConfigParser()
+    config['DEFAULT'] = {
+        'email': 'reader@example.com',
+        'smtp_host': smtp_address[0],
+        'smtp_port': str(smtp_address[1]),
+        'smtp_user': 'feedmailer@example.com'
+    }
+
+    with open(os.path.join(app_dir, 'feedmailer.cfg'), 'w') as f:
+        config.write(f)
+
+
+def add_subscriptions(db, urls, subscribers: int):
+    cur = db.cursor()
+
+    for url in urls:
+        cur.execute(
+            "INSERT INTO feeds(title, url, created_at) VALUES (?, ?, CURRENT_TIMESTAMP);", (url, url))
+        feed_id = cur.lastrowid
+
+        # subscribed long before any of the synthetic articles were published
+        cur.executemany(
+            "INSERT INTO subscriptions(email, feed_id, digest, desc_length, created_at) "
+            "VALUES (?, ?, ?, 300, '2000-01-01 00:00:00');",
+            ((f"reader{n}@example.com", feed_id, n % 2) for n in range(subscribers)))
+
+    db.commit()
+    cur.close()
+
+
+def run_suite(args) -> dict:
+    results = {}
+
+    with tempfile.TemporaryDirectory() as app_dir, FeedServer(args.feeds, args.entries) as feeds, SMTPSink() as smtp:
+        # APP_DIR is read when the commandline module is imported
+        os.environ['FEEDMAILER_APP_DIR'] = app_dir
+        commandline = importlib.import_module('feedmailer.commandline')
+        crud = importlib.import_module('feedmailer.crud')
+        feedparser = importlib.import_module('feedparser')
+
+        write_config(app_dir, smtp.address)
+
+        logger = logging.getLogger('feedmailer.benchmarks')
+        logger.addHandler(logging.NullHandler())
+        logger.propagate = False
+
+        config = commandline.init_config()
+        session = commandline.Session(
+            logger=logger,
+            config=config,
+            db=commandline.init_db(),
+            templates=commandline.init_templates(config)
+        )
+        db = session.db
+
+        add_subscriptions(db, feeds.urls, args.subscribers)
+        feed_list = crud.find_feeds(db)
+
+        def reset_articles():
+            db.execute("DELETE FROM outbox;")
+            db.execute("DELETE FROM articles;")
+            db.execute(
+                "UPDATE feeds SET etag = NULL, last_modified = NULL, content_hash = NULL;")
+            db.commit()
+
+        def reset_deliveries():
+            db.execute("DELETE FROM outbox;")
+            db.execute("UPDATE subscriptions SET attempted_delivery_at = NULL, delivered_article_id = 0;")
+            db.commit()
+
+        refresh_args = argparse.Namespace(
+            feed_id=None, all=True, concurrency=config['refresh_concurrency'], workers=0)
+
+        results['refresh_feeds'] = measure(
+            args.repeat, lambda: commandline.refresh_feeds(session, refresh_args), reset_articles)
+
+        if args.workers:
+            workers = importlib.import_module('feedmailer.workers')
+
+            # the pool is started beforehand so only parsing is timed
+            with workers.create_pool(args.workers, commandline.APP_DB_FILE) as pool:
+                pool.submit(int).result()
+                results['refresh_feeds_workers'] = measure(
+                    args.repeat, lambda: commandline.refresh_feeds(session, refresh_args, pool=pool), reset_articles)
+
+        # every feed answers 304 after the previous run
+        results['refresh_feeds_not_modified'] = measure(
+            args.repeat, lambda: commandline.refresh_feeds(session, refresh_args))
+
+        single_args = argparse.Namespace(feed_id=feed_list[0].feed_id)
+        results['refresh_feed'] = measure(
+            args.repeat, lambda: commandline.refresh_feed(session, single_args), reset_articles)
+
+        parsed = [(f.feed_id, feedparser.parse(body))
+                  for f, body in zip(feed_list, feeds.feeds.values())]
+        results['entry_to_article'] = measure(
+            args.repeat, lambda: [commandline.entry_to_article(e, feed_id)
+                                  for feed_id, data in parsed for e in data.entries])
+
+        articles = [(feed_id, [commandline.entry_to_article(e, feed_id) for e in data.entries])
+                    for feed_id, data in parsed]
+        results['crud.refresh_articles'] = measure(
+            args.repeat, lambda: [crud.refresh_articles(db, feed_id, a) for feed_id, a in articles], reset_articles)
+
+        subscription_ids = [
+            s.subscription_id for s in crud.find_subscriptions(db)]
+        results['crud.find_articles_for_delivery'] = measure(
+            args.repeat, lambda: [list(crud.find_articles_for_delivery(db, i)) for i in subscription_ids])
+
+        deliver_args = argparse.Namespace(
+            all=True, subscription_ids=[], pretend=False, combine_digests=False)
+        messages_before = smtp.messages
+        results['deliver_subscriptions'] = measure(
+            args.repeat, lambda: commandline.deliver_subscriptions(session, deliver_args), reset_deliveries)
+        results['deliver_subscriptions']['messages'] = (
+            smtp.messages - messages_before) // args.repeat
+
+        db.close()
+
+    return results
+
+
+def compare(before_file: str, after_file: str):
+    with open(before_file) as f:
+        before = json.load(f)
+
+    with open(after_file) as f:
+        after = json.load(f)
+
+    print(f"{'benchmark':<36} {'before':>10} {'after':>10} {'change':>8}")
+
+    for name, result in after['results'].items():
+        if name not in before['results']:
+            continue
+
+        old = before['results'][name]['median']
+        new = result['median']
+        print(f"{name:<36} {old:>9.3f}s {new:>9.3f}s {(new - old) / old * 100:>+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmarks.suite')
+    parser.add_argument('--feeds', type=int, default=50,
+                        help='Number of synthetic feeds')
+    parser.add_argument('--entries', type=int, default=100,
+                        help='Number of entries per feed')
+    parser.add_argument('--subscribers', type=int, default=2,
+                        help='Number of subscriptions to every feed')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of times each benchmark is ran')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Also time refreshing with this many parsing processes')
+    parser.add_argument('--output', type=str,
+                        help='File to write results to, printed when omitted')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help='Compare two result files instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'params': {
+            'feeds': args.feeds,
+            'entries': args.entries,
+            'subscribers': args.subscribers,
+            'repeat': args.repeat,
+            'workers': args.workers
+        },
+        'results': run_suite(args)
+    }
+
+    output = json.dumps(report, indent=2)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+    for name, result in report['results'].items():
+        print(f"{name:<36} {result['median']:>9.3f}s", file=sys.stderr)
+
+    if not args.output:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Compare rendering articles by compiling the template for every message,
+as feedmailer used to, against rendering through a shared environment.
+
+    python -m benchmarks.templates [renders]
+"""
+from datetime import datetime
+import os
+import sys
+import tempfile
+import time
+
+from jinja2 import Template
+
+from feedmailer.commandline import DATA_DIR, TEMPLATES
+from feedmailer.mailer import create_template_env
+from feedmailer.types import Article
+
+
+def make_article(i: int) -> Article:
+    now = datetime.now()
+
+    return Article(
+        article_id=i,
+        title=f"Article {i}",
+        url=f"https://example.com/articles/{i}",
+        author='Author',
+        feed_id=1,
+        category=None,
+        description='Lorem ipsum dolor sit amet. ' * 40,
+        published_at=now,
+        created_at=now,
+        updated_at=now,
+        guid=None
+    )
+
+
+def render_uncached(name: str, article: Article) -> str:
+    with open(os.path.join(DATA_DIR, name)) as f:
+        return Template(f.read()).render(article=article, feed_title='Feed', desc_length=300)
+
+
+def render_cached(env, name: str, article: Article) -> str:
+    return env.get_template(name).render(article=article, feed_title='Feed', desc_length=300)
+
+
+def run(label: str, renders: int, render) -> float:
+    started = time.perf_counter()
+
+    for i in range(renders):
+        render(make_article(i))
+
+    elapsed = time.perf_counter() - started
+    print(f"{label:<32} {renders / elapsed:>10.0f} renders/s")
+
+    return elapsed
+
+
+def main():
+    renders = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    for content_type, templates in TEMPLATES.items():
+        name = templates['article_template']
+        print(f"{name} ({renders} renders)")
+
+        uncached = run('compile per message', renders,
+                       lambda a: render_uncached(name, a))
+
+        env = create_template_env(DATA_DIR)
+        cached = run('shared environment', renders,
+                     lambda a: render_cached(env, name, a))
+
+        # a new environment per run, as with separate cron invocations,
+        # which only loads bytecode compiled by an earlier run
+        with tempfile.TemporaryDirectory() as cache_dir:
+            create_template_env(DATA_DIR, cache_dir).get_template(name)
+            run('fresh environment + bytecode', renders,
+                lambda a: render_cached(create_template_env(DATA_DIR, cache_dir), name, a))
+
+        print(f"{'speedup':<32} {uncached / cached:>10.1f}x\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,24 @@
 import argparse
 import configparser
-from dateutil import parser
-import feedparser
-import html2text
+import contextlib
 import logging
 import os
 from pathlib import Path
-
-from feedmailer import database, crud
-from feedmailer.mailer import Mailer
-from feedmailer.types import Article
+import signal
+from sqlite3 import Connection
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, Optional, Set, Tuple
+
+from feedmailer import database, crud, identity, metrics
+from feedmailer.types import Feed, FeedRefresh, NewArticle, NewMessage, NewSubscription
+
+# feedparser, html2text, dateutil, jinja2 and the modules which use them
+# are imported by the commands that need them, so commands which only
+# read the database start quickly
+if TYPE_CHECKING:
+    from feedmailer.fetcher import FetchResult
+    from feedmailer.mailer import Mailer
 
 APP_NAME = 'feedmailer'
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
@@ -18,19 +27,28 @@ APP_DIR = os.environ.get("FEEDMAILER_APP_DIR", os.path.join(
 APP_CONFIG_FILE = os.path.join(APP_DIR, APP_NAME + '.cfg')
 APP_LOG_FILE = os.path.join(APP_DIR, APP_NAME + '.log')
 APP_DB_FILE = os.path.join(APP_DIR, APP_NAME + '.db')
+APP_TEMPLATE_CACHE_DIR = os.path.join(APP_DIR, 'cache', 'templates')
+APP_METRICS_DIR = os.path.join(APP_DIR, 'metrics')
+APP_PROFILE_DIR = os.path.join(APP_DIR, 'profiles')
 DEFAULT_CONFIG_FILE = os.path.join(DATA_DIR, 'defaults.cfg')
 DEFAULT_SENDER_NAME = 'Feed Mailer'
 
+# number of functions printed after profiling a command
+PROFILE_TOP_FUNCTIONS = 25
+
 
+# template names are looked up within DATA_DIR
 TEMPLATES = {
     'plain': {
-        'article_template': os.path.join(DATA_DIR, 'article.txt.jinja'),
-        'digest_template': os.path.join(DATA_DIR, 'digest.txt.jinja'),
+        'article_template': 'article.txt.jinja',
+        'digest_template': 'digest.txt.jinja',
+        'combined_digest_template': 'combined_digest.txt.jinja',
         'content_type': 'plain'
     },
     'html': {
-        'article_template': os.path.join(DATA_DIR, 'article.html.jinja'),
-        'digest_template': os.path.join(DATA_DIR, 'digest.html.jinja'),
+        'article_template': 'article.html.jinja',
+        'digest_template': 'digest.html.jinja',
+        'combined_digest_template': 'combined_digest.html.jinja',
         'content_type': 'html'
     }
 }
@@ -45,6 +63,17 @@ class Session():
         self.config = kwargs['config']
         self.db = kwargs['db']
         self.logger = kwargs['logger']
+        self._templates = kwargs.get('templates')
+        # log how long each phase of a run took
+        self.profile = kwargs.get('profile', False)
+
+    # templates are loaded the first time a command renders a message
+    @property
+    def templates(self):
+        if self._templates is None:
+            self._templates = init_templates(self.config)
+
+        return self._templates
 
 
 def init_config():
@@ -53,10 +82,13 @@ def init_config():
     if not os.path.exists(APP_DIR):
         os.makedirs(APP_DIR)
 
+    # defaults are always read first so options added after a config
+    # file was created still have a value
+    with open(DEFAULT_CONFIG_FILE) as f:
+        config_parser.read_file(f)
+
     # write a default config if one does not exist yet
     if not os.path.exists(APP_CONFIG_FILE):
-        config_parser.read_file(open(DEFAULT_CONFIG_FILE))
-
         with open(APP_CONFIG_FILE, 'w') as config:
             config_parser.write(config)
 
@@ -68,16 +100,49 @@ def init_config():
     if config_parser['DEFAULT']['content_type'] not in list(TEMPLATES.keys()):
         raise ConfigError("Invalid content_type provided")
 
+    metrics_formats = [f.strip() for f in config_parser['DEFAULT']['metrics'].split(',')
+                       if f.strip()]
+
+    if any(f not in metrics.FORMATS for f in metrics_formats):
+        raise ConfigError("Invalid metrics format provided")
+
     return {
         'email': config_parser['DEFAULT']['email'],
         'content_type': config_parser['DEFAULT']['content_type'],
         'digest': config_parser['DEFAULT'].getboolean('digest'),
+        'combine_digests': config_parser['DEFAULT'].getboolean('combine_digests'),
         'smtp_user': config_parser['DEFAULT']['smtp_user'],
         'smtp_host': config_parser['DEFAULT']['smtp_host'],
         'smtp_auth': config_parser['DEFAULT'].getboolean('smtp_auth'),
         'smtp_ssl': config_parser['DEFAULT'].getboolean('smtp_ssl'),
         'smtp_password': config_parser['DEFAULT']['smtp_password'],
-        'smtp_port': config_parser['DEFAULT'].getint('smtp_port')
+        'smtp_port': config_parser['DEFAULT'].getint('smtp_port'),
+        'smtp_max_messages': config_parser['DEFAULT'].getint('smtp_max_messages'),
+        'refresh_concurrency': config_parser['DEFAULT'].getint('refresh_concurrency'),
+        'refresh_host_concurrency': config_parser['DEFAULT'].getint('refresh_host_concurrency'),
+        'refresh_timeout': config_parser['DEFAULT'].getfloat('refresh_timeout'),
+        'refresh_workers': config_parser['DEFAULT'].getint('refresh_workers'),
+        'refresh_lease_duration': config_parser['DEFAULT'].getint('refresh_lease_duration'),
+        'refresh_lease_batch_size': config_parser['DEFAULT'].getint('refresh_lease_batch_size'),
+        'stream_threshold': config_parser['DEFAULT'].getint('stream_threshold'),
+        'stream_batch_size': config_parser['DEFAULT'].getint('stream_batch_size'),
+        'template_cache': config_parser['DEFAULT'].getboolean('template_cache'),
+        'render_cache_size': config_parser['DEFAULT'].getint('render_cache_size'),
+        'render_cache_persist': config_parser['DEFAULT'].getboolean('render_cache_persist'),
+        'outbox_workers': config_parser['DEFAULT'].getint('outbox_workers'),
+        'outbox_max_attempts': config_parser['DEFAULT'].getint('outbox_max_attempts'),
+        'outbox_retry_delay': config_parser['DEFAULT'].getfloat('outbox_retry_delay'),
+        'refresh_interval': config_parser['DEFAULT'].getint('refresh_interval'),
+        'refresh_min_interval': config_parser['DEFAULT'].getint('refresh_min_interval'),
+        'refresh_max_interval': config_parser['DEFAULT'].getint('refresh_max_interval'),
+        'delivery_interval': config_parser['DEFAULT'].getint('delivery_interval'),
+        'daemon_poll_interval': config_parser['DEFAULT'].getfloat('daemon_poll_interval'),
+        'retention_days': config_parser['DEFAULT'].getint('retention_days'),
+        'retention_per_feed': config_parser['DEFAULT'].getint('retention_per_feed'),
+        'prune_after_refresh': config_parser['DEFAULT'].getboolean('prune_after_refresh'),
+        'prune_batch_size': config_parser['DEFAULT'].getint('prune_batch_size'),
+        'auto_vacuum': config_parser['DEFAULT'].getboolean('auto_vacuum'),
+        'metrics': metrics_formats
     }
 
 
@@ -87,6 +152,19 @@ def init_db():
     return db
 
 
+def init_templates(config):
+    from feedmailer.mailer import create_template_env
+
+    cache_dir = None
+
+    if config['template_cache']:
+        cache_dir = APP_TEMPLATE_CACHE_DIR
+        # templates are loaded by every outbox worker at the same time
+        os.makedirs(cache_dir, exist_ok=True)
+
+    return create_template_env(DATA_DIR, cache_dir)
+
+
 def init_logger():
     if not os.path.exists(APP_DIR):
         os.makedirs(APP_DIR)
@@ -108,7 +186,22 @@ def init_logger():
     return logger
 
 
-def init_arg_parser(session: Session):
+# Parse a shard given as INDEX/COUNT, such as 0/4
+def parse_shard(value: str) -> Tuple[int, int]:
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"'{value}' is not a shard in the form INDEX/COUNT")
+
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(
+            f"Shard index must be between 0 and {count - 1}")
+
+    return index, count
+
+
+def init_arg_parser(config):
     parser = argparse.ArgumentParser(
         prog=APP_NAME,
         description="Deliver feeds by email"
@@ -139,7 +232,7 @@ def init_arg_parser(session: Session):
         digest=False,
         max_age=None,
         desc_length=300,
-        email=session.config.get('email', None)
+        email=config.get('email', None)
     )
 
     # List command
@@ -159,6 +252,49 @@ def init_arg_parser(session: Session):
         'refresh', help='Fetch latest articles and store them for mailing')
     parser_refresh.add_argument(
         'feed_id', type=int, nargs='?', help='id of feed')
+    parser_refresh.add_argument(
+        '--concurrency',
+        type=int,
+        dest='concurrency',
+        help='Number of feeds to fetch at the same time. Use 1 to fetch feeds one after another'
+    )
+
+    parser_refresh.add_argument(
+        '--all',
+        action='store_true',
+        dest='all',
+        help='Refresh every feed instead of only the ones which are due'
+    )
+
+    parser_refresh.add_argument(
+        '--workers',
+        type=int,
+        dest='workers',
+        help='Number of processes parsing feeds when refreshing several. Use 0 to parse them on the threads fetching them'
+    )
+
+    parser_refresh.add_argument(
+        '--worker-id',
+        type=str,
+        dest='worker_id',
+        help='Claim due feeds in batches under this id, so several refreshes can run at once without refreshing the same feed'
+    )
+
+    parser_refresh.add_argument(
+        '--shard',
+        type=parse_shard,
+        dest='shard',
+        metavar='INDEX/COUNT',
+        help='Only refresh feeds whose id modulo COUNT is INDEX, claiming them as with --worker-id'
+    )
+
+    parser_refresh.set_defaults(
+        concurrency=config.get('refresh_concurrency', 1),
+        workers=config.get('refresh_workers', 0),
+        worker_id=None,
+        shard=None,
+        all=False
+    )
 
     # Deliver command
     parser_deliver = subparsers.add_parser(
@@ -169,10 +305,17 @@ def init_arg_parser(session: Session):
     parser_deliver.add_argument(
         'subscription_ids',
         type=int,
-        nargs='+',
+        nargs='*',
         help='ids of subscriptions to deliver'
     )
 
+    parser_deliver.add_argument(
+        '--all',
+        action='store_true',
+        dest='all',
+        help='Deliver every subscription'
+    )
+
     parser_deliver.add_argument(
         '--pretend',
         action='store_true',
@@ -180,30 +323,197 @@ def init_arg_parser(session: Session):
         help='Don\'t actually mail anything, instead print out what would be delivered. Useful for debugging.'
     )
 
-    parser_deliver.set_defaults(pretend=False)
+    parser_deliver.add_argument(
+        '--combine-digests',
+        action='store_true',
+        dest='combine_digests',
+        help='Send all digests of an email as one message'
+    )
+
+    parser_deliver.set_defaults(
+        pretend=False,
+        all=False,
+        combine_digests=config.get('combine_digests', False)
+    )
+
+    # Outbox command
+    parser_outbox = subparsers.add_parser(
+        'outbox',
+        help='Send messages waiting in the outbox, such as ones being retried'
+    )
+
+    parser_outbox.add_argument(
+        '--retry-dead',
+        action='store_true',
+        dest='retry_dead',
+        help='Also retry messages which ran out of attempts'
+    )
+
+    parser_outbox.set_defaults(retry_dead=False)
+
+    # Daemon command
+    parser_daemon = subparsers.add_parser(
+        'daemon',
+        help='Keep running, refreshing feeds and delivering subscriptions as they become due'
+    )
+
+    parser_daemon.add_argument(
+        '--poll-interval',
+        type=float,
+        dest='poll_interval',
+        help='Seconds to wait between checking for due feeds and subscriptions'
+    )
+
+    parser_daemon.add_argument(
+        '--concurrency',
+        type=int,
+        dest='concurrency',
+        help='Number of feeds to fetch at the same time'
+    )
+
+    parser_daemon.add_argument(
+        '--workers',
+        type=int,
+        dest='workers',
+        help='Number of processes parsing feeds'
+    )
+
+    parser_daemon.set_defaults(
+        poll_interval=config.get('daemon_poll_interval', 60),
+        concurrency=config.get('refresh_concurrency', 1),
+        workers=config.get('refresh_workers', 0)
+    )
+
+    # Set interval command
+    parser_interval = subparsers.add_parser(
+        'set-interval',
+        help='Change how often a feed is refreshed or a subscription delivered by the daemon'
+    )
+
+    parser_interval.add_argument(
+        'kind', choices=['feed', 'subscription'], help='what to change the interval of')
+    parser_interval.add_argument(
+        'id', type=int, help='id of the feed or subscription')
+    parser_interval.add_argument(
+        'seconds', type=int, nargs='?', help='interval in seconds, omit to use the configured default')
+
+    # Prune command
+    parser_prune = subparsers.add_parser(
+        'prune',
+        help='Delete old articles according to the retention policy'
+    )
+
+    parser_prune.add_argument(
+        '--days',
+        type=int,
+        dest='days',
+        help='Delete articles published more than this many days ago'
+    )
+
+    parser_prune.add_argument(
+        '--per-feed',
+        type=int,
+        dest='per_feed',
+        help='Number of the newest articles of each feed to keep'
+    )
+
+    parser_prune.add_argument(
+        '--vacuum',
+        action='store_true',
+        dest='vacuum',
+        help='Rebuild the database file afterwards to reclaim free space'
+    )
+
+    parser_prune.set_defaults(
+        days=config.get('retention_days', 0),
+        per_feed=config.get('retention_per_feed', 0),
+        vacuum=False
+    )
+
+    # Import command
+    parser_import = subparsers.add_parser(
+        'import',
+        help='Subscribe to every feed of an opml file'
+    )
+
+    parser_import.add_argument('file', type=str, help='opml file to import')
+    parser_import.add_argument('--email', type=str, dest='email',
+                               help='The email address to deliver the feeds to')
+    parser_import.add_argument('--desc-length', type=int, dest='desc_length',
+                               help='Change max length for article descriptions')
+
+    parser_import.add_argument(
+        '--digest',
+        action='store_true',
+        dest='digest',
+        help='Send items as a digest instead of individually'
+    )
+
+    parser_import.add_argument(
+        '--concurrency',
+        type=int,
+        dest='concurrency',
+        help='Number of feeds to validate at the same time'
+    )
+
+    parser_import.set_defaults(
+        digest=False,
+        desc_length=300,
+        email=config.get('email', None),
+        concurrency=config.get('refresh_concurrency', 1)
+    )
+
+    # Export command
+    parser_export = subparsers.add_parser(
+        'export',
+        help='Write the feeds an email is subscribed to as opml'
+    )
+
+    parser_export.add_argument('--email', type=str, dest='email',
+                               help='The email address whose subscriptions are exported')
+    parser_export.add_argument('--output', type=str, dest='output',
+                               help='File to write to instead of printing the opml')
+
+    parser_export.set_defaults(
+        email=config.get('email', None),
+        output=None
+    )
+
+    # every command can be profiled
+    for subparser in subparsers.choices.values():
+        subparser.add_argument(
+            '--profile',
+            nargs='?',
+            const='',
+            metavar='PATH',
+            dest='profile',
+            help='Profile the command, writing the profile to PATH or a new file in ' + APP_PROFILE_DIR
+        )
 
     return parser
 
 
 # convert feedparser entry to db schema of an article
-def entry_to_article(entry) -> Article:
-    published = None
+def entry_to_article(entry, feed_id: int) -> NewArticle:
+    import html2text
+
+    from feedmailer import dates
+
     author = None
     h = html2text.HTML2Text()
     h.ignore_links = True
 
-    if 'published' in entry and entry.published:
-        published = parser.parse(entry.published)
-
     if 'author' in entry and entry.author:
         author = entry.author
 
-    return Article(
+    return NewArticle(
         title=h.handle(entry.title).strip(),
         url=entry.link,
         author=author,
+        feed_id=feed_id,
         description=h.handle(entry.description).strip(),
-        published_at=published
+        published_at=dates.entry_published(entry),
+        guid=identity.article_guid(entry, feed_id)
     )
 
 
@@ -224,6 +534,8 @@ def add_feed(session: Session, args: argparse.Namespace):
             "This feed is already being delivered to the email provided.")
         return
 
+    import feedparser
+
     data = feedparser.parse(args.url)
 
     if data.bozo:
@@ -239,6 +551,92 @@ def add_feed(session: Session, args: argparse.Namespace):
                           max_age=args.max_age)
 
 
+# Subscribe to every feed of an opml file at once. Feeds which are not
+# stored yet are fetched concurrently to validate them, and all of the
+# subscriptions are added within one transaction. The articles found while
+# validating are stored as the feeds' first refresh, along with the
+# validators of the responses, so the next refresh doesn't repeat the work.
+def import_feeds(session: Session, args: argparse.Namespace):
+    from xml.etree.ElementTree import ParseError
+    from feedmailer import fetcher, opml
+
+    config = session.config
+
+    if not args.email:
+        session.logger.error(
+            "An email must be provided either within the config file or as an argument to the 'import' command.")
+        return
+
+    try:
+        outlines = opml.read_feeds(args.file)
+    except (OSError, ParseError) as e:
+        session.logger.error(f"Unable to read '{args.file}': {e}")
+        return
+
+    known = {f.url: f for f in crud.find_feeds(session.db)}
+    new_feeds = [Feed(feed_id=None, title=title, created_at=None, refreshed_at=None, updated_at=None,
+                      url=url, etag=None, last_modified=None, content_hash=None, refresh_interval=None,
+                      next_refresh_at=None, empty_refreshes=0, failed_refreshes=0, hint_interval=None)
+                 for title, url in outlines if url not in known]
+
+    started = time.perf_counter()
+    results = []
+
+    for r in fetcher.fetch_feeds(new_feeds,
+                                 concurrency=args.concurrency,
+                                 host_concurrency=config['refresh_host_concurrency'],
+                                 timeout=config['refresh_timeout']):
+        if r.error or r.data.bozo:
+            session.logger.error(
+                f"Skipping invalid feed '{r.feed.url}': {r.error or r.data.get('bozo_exception')}")
+        else:
+            results.append(r)
+
+    # titles given in the opml are used over the feed's own
+    titles = {r.feed.url: r.feed.title or r.data.feed.get('title') or r.feed.url
+              for r in results}
+    titles.update((url, f.title) for url, f in known.items())
+
+    num_added = crud.add_subscriptions(session.db, [NewSubscription(
+        title=titles[url],
+        url=url,
+        email=args.email,
+        digest=args.digest,
+        desc_length=args.desc_length
+    ) for _, url in outlines if url in titles])
+
+    feeds = {f.url: f for f in crud.find_feeds(session.db)}
+
+    for r in results:
+        r.feed = feeds[r.feed.url]
+
+    run = metrics.RunMetrics('import')
+    num_articles = sum(store_results(session, results, run).values())
+    finish_run(session, run)
+
+    session.logger.info(
+        f"Subscribed {args.email} to {num_added} of {len(outlines)} feed(s) in "
+        f"{time.perf_counter() - started:.2f}s, storing {num_articles} article(s)")
+
+    return num_added
+
+
+def export_feeds(session: Session, args: argparse.Namespace):
+    from feedmailer import opml
+
+    # feeds several emails are subscribed to are only listed once
+    subscriptions = list({s.url: s for s in crud.find_subscriptions(session.db, email=args.email)}.values())
+    content = opml.write_feeds(subscriptions, f"{APP_NAME} subscriptions of {args.email or 'everyone'}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(content)
+    else:
+        print(content, end='')
+
+    return len(subscriptions)
+
+
 def list_subscriptions(session: Session):
     subscriptions = crud.find_subscriptions(session.db)
 
@@ -261,16 +659,27 @@ def list_feeds(session: Session):
 
 
 def refresh_feed(session: Session, args: argparse.Namespace):
+    from feedmailer import fetcher
+
     feed = crud.find_feed_by_id(session.db, args.feed_id)
 
     if not feed:
         session.logger.error("No feed exists with that id.")
         return
 
-    data = feedparser.parse(feed.url)
+    run = metrics.RunMetrics('refresh')
 
-    articles = list(map((lambda a: entry_to_article(a)), data.entries))
-    num_added = crud.refresh_articles(session.db, args.feed_id, articles)
+    result = fetcher.fetch_feed(
+        feed,
+        session.config['refresh_timeout'],
+        stream_threshold=session.config['stream_threshold']
+    )
+
+    num_added = store_results(session, [result], run)[feed.feed_id]
+    finish_run(session, run)
+
+    if result.error:
+        return
 
     if num_added > 0:
         session.logger.info(
@@ -295,92 +704,792 @@ def remove_subscription(session: Session, args: argparse.Namespace):
     crud.remove_subscription(session.db, args.subscription_id)
 
 
-def refresh_feeds(session: Session):
-    feeds = crud.find_feeds(session.db)
+# Store the results of fetching feeds as they come in. Articles of every
+# feed are inserted within one transaction and the refresh of every feed
+# is recorded within another, rather than committing for each feed.
+# Large feeds which are streamed are stored while they are parsed.
+# Returns the number of new articles of each feed. How long each feed
+# took is recorded in run.
+def store_results(session: Session, results, run: metrics.RunMetrics) -> Dict[int, int]:
+    from feedmailer import schedule
+
+    articles_by_feed = {}
+    num_added = {}
+    finished = []
+
+    for r in results:
+        feed = r.feed
+        hint = None
+
+        run.set_feed(
+            feed.feed_id,
+            url=feed.url,
+            title=feed.title,
+            http_status=r.status,
+            bytes=r.size,
+            fetch_seconds=r.fetch_time,
+            parse_seconds=r.parse_time,
+            error=int(r.error is not None)
+        )
+
+        if not r.error:
+            try:
+                if r.body:
+                    num_added[feed.feed_id] = store_streamed_articles(
+                        session, r, run)
+                elif r.parsed:
+                    # parsed and converted by a worker process
+                    hint = r.parsed.hint_interval
+                    articles_by_feed[feed.feed_id] = r.parsed.articles
+                    run.set_feed(feed.feed_id,
+                                 convert_seconds=r.parsed.convert_time)
+                    run.count('known_entries', r.parsed.known_entries)
+
+                    if r.parsed.listed:
+                        crud.forget_pruned_articles(
+                            session.db, feed.feed_id, *r.parsed.listed)
+
+                    r.parsed = None
+                elif r.modified:
+                    hint = schedule.hint_interval(r.data.feed)
+
+                    started = time.perf_counter()
+                    articles_by_feed[feed.feed_id] = [
+                        entry_to_article(e, feed.feed_id) for e in new_entries(session, feed.feed_id, r.data.entries, run)]
+                    run.set_feed(feed.feed_id,
+                                 convert_seconds=time.perf_counter() - started)
+
+                    if crud.has_pruned_articles(session.db, feed.feed_id):
+                        crud.forget_pruned_articles(
+                            session.db, feed.feed_id, *entry_keys(r.data.entries, feed.feed_id))
+
+                    # only the articles are needed from here on
+                    r.data = None
+            except Exception as e:
+                # an entry which can't be converted only fails its own feed,
+                # as it does when parsed by a worker process
+                session.db.rollback()
+                r.error = e
+                r.data = None
+                hint = None
+
+        if r.error:
+            session.logger.error(
+                f"Unable to refresh '{feed.title}': {r.error}")
+            run.count('feeds_failed')
+            run.set_feed(feed.feed_id, error=1)
+
+        finished.append((r, hint))
+
+    started = time.perf_counter()
+    num_added.update(crud.refresh_articles_bulk(session.db, articles_by_feed))
+    run.add_time('store_articles', time.perf_counter() - started)
+
+    started = time.perf_counter()
+    crud.record_refreshes(session.db, [
+        refresh_record(session, r, hint, num_added.setdefault(r.feed.feed_id, 0)) for r, hint in finished])
+    run.add_time('record_refreshes', time.perf_counter() - started)
+
+    for feed_id, n in num_added.items():
+        run.set_feed(feed_id, new_articles=n)
+
+    run.count('feeds', len(finished))
+    run.count('new_articles', sum(num_added.values()))
+
+    return num_added
+
+
+# Entries of a feed which are not stored yet, counting the ones which
+# are in run
+def new_entries(session: Session, feed_id: int, entries, run: metrics.RunMetrics) -> list:
+    new = unknown_entries(session.db, feed_id, entries)
+    run.count('known_entries', len(entries) - len(new))
+
+    return new
+
+
+# Urls and guids of the entries of a feed
+def entry_keys(entries, feed_id: int) -> Tuple[Set[str], Set[str]]:
+    return ({e.get('link') for e in entries},
+            {identity.article_guid(e, feed_id) for e in entries})
+
+
+# Most entries were already seen on earlier refreshes, so they are
+# looked up by url and guid before any of them are converted into
+# articles.
+def unknown_entries(conn: Connection, feed_id: int, entries) -> list:
+    keys = [(e.get('link'), identity.article_guid(e, feed_id)) for e in entries]
+    known_urls, known_guids = crud.find_known_entries(
+        conn, feed_id,
+        [url for url, _ in keys if url],
+        [guid for _, guid in keys])
+
+    return [e for e, (url, guid) in zip(entries, keys)
+            if url not in known_urls and guid not in known_guids]
+
+
+# Work out when a feed is next due from how often it posts, the hints
+# it gives and how its recent refreshes went. Feeds with an interval set
+# are always refreshed at that interval.
+def refresh_record(session: Session, result: 'FetchResult', hint: Optional[int], num_added: int) -> FeedRefresh:
+    from feedmailer import schedule
+
+    config = session.config
+    feed = result.feed
+    status = 'ok'
+
+    if result.error:
+        status = 'error'
+    elif not result.modified:
+        status = 'not_modified'
+
+    empty_refreshes = feed.empty_refreshes
+
+    if not result.error:
+        empty_refreshes = 0 if num_added else empty_refreshes + 1
+
+    failed_refreshes = feed.failed_refreshes + 1 if result.error else 0
+    interval = feed.refresh_interval
+
+    if not interval:
+        interval = schedule.next_refresh_interval(
+            publish_times=crud.find_recent_publish_times(
+                session.db, feed.feed_id, 10),
+            hint=hint or feed.hint_interval,
+            empty_refreshes=empty_refreshes,
+            failed_refreshes=failed_refreshes,
+            default_interval=config['refresh_interval'],
+            min_interval=config['refresh_min_interval'],
+            max_interval=config['refresh_max_interval']
+        )
+
+    # a failed request leaves the validators of the last response in place
+    response = feed if result.error else result
+
+    return FeedRefresh(
+        feed_id=feed.feed_id,
+        status=status,
+        new_articles=num_added,
+        interval=interval,
+        empty_refreshes=empty_refreshes,
+        failed_refreshes=failed_refreshes,
+        hint_interval=hint,
+        etag=response.etag,
+        last_modified=response.last_modified,
+        content_hash=response.content_hash
+    )
+
+
+# Large feeds are parsed incrementally and stored in fixed size batches
+# so memory use stays flat regardless of the size of the feed.
+def store_streamed_articles(session: Session, result: 'FetchResult', run: metrics.RunMetrics) -> int:
+    from xml.etree.ElementTree import ParseError
+    import feedparser
+    from feedmailer import stream
+
+    feed = result.feed
     num_added = 0
+    # parsing is interleaved with converting and storing, so it is
+    # whatever time is left over from those
+    started = time.perf_counter()
+    convert_time = 0.0
+    store_time = 0.0
+    # keys of every entry, only collected when there are pruned articles
+    # to forget once the feed no longer lists them
+    listed = (set(), set()) if crud.has_pruned_articles(
+        session.db, feed.feed_id) else None
+
+    def store(entries):
+        nonlocal num_added, convert_time, store_time
+
+        if listed:
+            urls, guids = entry_keys(entries, feed.feed_id)
+            listed[0].update(urls)
+            listed[1].update(guids)
+
+        converting = time.perf_counter()
+        articles = [entry_to_article(e, feed.feed_id)
+                    for e in new_entries(session, feed.feed_id, entries, run)]
+        storing = time.perf_counter()
+        num_added += crud.refresh_articles(session.db, feed.feed_id, articles)
+
+        convert_time += storing - converting
+        store_time += time.perf_counter() - storing
+
+    with result.body as body:
+        entries = stream.iter_entries(body)
+
+        try:
+            for batch in stream.iter_batches(entries, session.config['stream_batch_size']):
+                store(batch)
+        except ParseError as e:
+            # feedparser copes with feeds that are not well formed xml
+            session.logger.warning(
+                f"Unable to stream '{feed.title}', parsing it whole instead: {e}")
+
+            body.seek(0)
+            store(feedparser.parse(body.read()).entries)
+
+    if listed:
+        crud.forget_pruned_articles(session.db, feed.feed_id, *listed)
+
+    run.set_feed(
+        feed.feed_id,
+        parse_seconds=time.perf_counter() - started - convert_time - store_time,
+        convert_seconds=convert_time
+    )
+    run.add_time('store_articles', store_time)
 
-    for f in feeds:
-        data = feedparser.parse(f.url)
-        articles = list(map((lambda a: entry_to_article(a)), data.entries))
-        num_added += crud.refresh_articles(session.db, f.feed_id, articles)
+    return num_added
+
+
+# Feeds are fetched and parsed concurrently while articles are collected
+# from this thread as each feed finishes, since the db connection can
+# not be shared between threads. With --workers feeds are parsed by a
+# pool of processes instead, so parsing is spread over several cores,
+# and pool can be given to reuse one between runs. Only feeds which are
+# due are refreshed unless --all is used or a list of feeds is given.
+def refresh_feeds(session: Session, args: argparse.Namespace, feeds=None, pool=None):
+    from feedmailer import fetcher, workers
+
+    config = session.config
+
+    if feeds is None:
+        feeds = crud.find_feeds(
+            session.db) if args.all else crud.find_due_feeds(session.db)
+
+    started = time.perf_counter()
+    run = metrics.RunMetrics('refresh')
+
+    with contextlib.ExitStack() as stack:
+        if pool is None and args.workers > 0:
+            pool = stack.enter_context(workers.create_pool(args.workers, APP_DB_FILE))
+
+        results = fetcher.fetch_feeds(
+            feeds,
+            concurrency=args.concurrency,
+            host_concurrency=config['refresh_host_concurrency'],
+            timeout=config['refresh_timeout'],
+            stream_threshold=config['stream_threshold'],
+            parse=pool is None
+        )
+
+        if pool:
+            results = workers.parse_results(pool, results)
+
+        num_added = sum(store_results(session, results, run).values())
+
+    elapsed = time.perf_counter() - started
+    finish_run(session, run)
 
     session.logger.info(f"{num_added} new articles found in total")
+    session.logger.info(
+        f"Refreshed {len(feeds)} feed(s) in {elapsed:.2f}s with a concurrency of {args.concurrency}")
 
     return num_added
 
 
+# Refresh due feeds in batches claimed through leases, so refreshes
+# running at the same time, in other processes or on other hosts sharing
+# the database, never refresh the same feed. A batch's leases are renewed
+# while it is refreshed and released once it is done. Leases of a worker
+# which died expire after refresh_lease_duration seconds and its feeds
+# are claimed by others. Stops once no more feeds can be claimed.
+def refresh_leased_feeds(session: Session, args: argparse.Namespace):
+    import socket
+
+    config = session.config
+
+    if args.all:
+        session.logger.error(
+            "--all can not be combined with --worker-id or --shard.")
+        return
+
+    worker_id = args.worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    shard_index, shard_count = args.shard or (0, 1)
+    lease_duration = config['refresh_lease_duration']
+    num_added = 0
+
+    with contextlib.ExitStack() as stack:
+        pool = None
+
+        if args.workers > 0:
+            from feedmailer import workers
+
+            pool = stack.enter_context(workers.create_pool(args.workers, APP_DB_FILE))
+
+        while feeds := crud.claim_feeds(session.db, worker_id, config['refresh_lease_batch_size'],
+                                        lease_duration, shard_index, shard_count):
+            feed_ids = [f.feed_id for f in feeds]
+
+            try:
+                with renewing_leases(worker_id, feed_ids, lease_duration):
+                    num_added += refresh_feeds(session, args, feeds, pool)
+            finally:
+                crud.release_leases(session.db, worker_id, feed_ids)
+
+    session.logger.info(
+        f"Worker {worker_id} found {num_added} new articles in total")
+
+    return num_added
+
+
+# Renew leases from another thread every third of their duration until
+# the block exits. The thread has a connection of its own since
+# connections can not be shared between threads.
+@contextlib.contextmanager
+def renewing_leases(worker_id: str, feed_ids, lease_duration: int):
+    stopping = threading.Event()
+
+    def renew():
+        conn = database.connect(APP_DB_FILE)
+
+        try:
+            while not stopping.wait(lease_duration / 3):
+                crud.renew_leases(conn, worker_id, feed_ids, lease_duration)
+        finally:
+            conn.close()
+
+    thread = threading.Thread(target=renew, daemon=True)
+    thread.start()
+
+    try:
+        yield
+    finally:
+        stopping.set()
+        thread.join()
+
+
+# Articles for every subscription being delivered are found with one
+# query and grouped here, so the cost of a run grows with the number of
+# new articles rather than the number of subscriptions. Messages are
+# rendered into the outbox and then sent from there, along with any
+# earlier messages which are due to be retried.
 def deliver_subscriptions(session: Session, args: argparse.Namespace):
-    for subscription_id in args.subscription_ids:
-        subscription = crud.find_subscription_by_id(
-            session.db,
-            subscription_id
-        )
+    if not args.all and not args.subscription_ids:
+        session.logger.error(
+            "Either provide ids of subscriptions to deliver or use --all.")
+        return
 
-        config = session.config
+    subscriptions = {
+        s.subscription_id: s for s in crud.find_subscriptions(session.db)}
+    subscription_ids = list(subscriptions.keys())
 
-        if not subscription:
-            session.logger.error(
-                f"No subscription exists with id of {subscription_id}")
-            return
+    if not args.all:
+        subscription_ids = args.subscription_ids
 
-        articles = crud.find_articles_for_delivery(
-            session.db,
-            subscription_id
-        )
+        for subscription_id in subscription_ids:
+            if subscription_id not in subscriptions:
+                session.logger.error(
+                    f"No subscription exists with id of {subscription_id}")
+                return
+
+    run = metrics.RunMetrics('deliver')
+    pending = {}
+
+    started = time.perf_counter()
+
+    for subscription_id, article in crud.find_pending_deliveries(session.db, subscription_ids):
+        pending.setdefault(subscription_id, []).append(article)
+
+    run.add_time('find_articles', time.perf_counter() - started)
 
-        if not articles:
+    for subscription_id in subscription_ids:
+        if subscription_id not in pending:
             session.logger.info(
-                "No articles to deliver for subscription  {subscription_id}")
-            continue
+                f"No articles to deliver for subscription {subscription_id}")
 
-        if args.pretend:
+    if args.pretend:
+        for subscription_id, articles in pending.items():
             for a in articles:
                 print(
-                    f"{a.article_id}. {subscription.title} - {a.title} ({a.url})\n")
-            continue
+                    f"{a.article_id}. {subscriptions[subscription_id].title} - {a.title} ({a.url})\n")
+        return
+
+    if pending:
+        queue_deliveries(session, subscriptions, pending,
+                         run, args.combine_digests)
+
+    num_sent = send_outbox(session, run=run)
+    finish_run(session, run)
 
-        crud.set_attempted_delivery_at(session.db, subscription_id)
+    return num_sent
 
-        mailer = Mailer(
-            host=config['smtp_host'],
-            port=config['smtp_port'],
-            user=config['smtp_user'],
-            password=config['smtp_password'],
-            auth=config['smtp_auth'],
-            ssl=config['smtp_ssl'],
-            to_email=subscription.email
+
+# Render the messages of subscriptions with pending articles into the
+# outbox. With combine_digests the digests of every subscription of an
+# email are sent as one message.
+def queue_deliveries(session: Session, subscriptions, pending, run: metrics.RunMetrics, combine_digests: bool = False):
+    from feedmailer.render_cache import RenderCache
+
+    config = session.config
+    content_type = config['content_type']
+    renderer = create_mailer(session)
+    messages = []
+    digests_by_email = {}
+
+    if config['render_cache_size'] > 0:
+        renderer.render_cache = RenderCache(
+            config['render_cache_size'],
+            session.db if config['render_cache_persist'] else None
         )
+    started = time.perf_counter()
 
-        content_type = config['content_type']
+    for subscription_id, articles in pending.items():
+        subscription = subscriptions[subscription_id]
+
+        if subscription.digest and combine_digests:
+            digests_by_email.setdefault(subscription.email, []).append(dict(
+                subscription_id=subscription_id,
+                feed_title=subscription.title,
+                articles=articles,
+                desc_length=subscription.desc_length
+            ))
+            continue
 
         if subscription.digest:
-            mailer.send_digest(
+            rendered = [renderer.render_digest(
                 feed_title=subscription.title,
                 articles=articles,
-                content_type=content_type,
                 desc_length=subscription.desc_length,
                 template=TEMPLATES[content_type]['digest_template']
-            )
+            )]
         else:
-            for a in articles:
-                mailer.send_article(
-                    feed_title=subscription.title,
-                    article=a,
-                    content_type=content_type,
-                    desc_length=subscription.desc_length,
-                    template=TEMPLATES[content_type]['article_template']
-                )
+            rendered = [renderer.render_article(
+                feed_title=subscription.title,
+                article=a,
+                desc_length=subscription.desc_length,
+                template=TEMPLATES[content_type]['article_template'],
+                content_type=content_type
+            ) for a in articles]
+
+        messages += [NewMessage(
+            subscription_id=subscription_id,
+            email=subscription.email,
+            subject=subject,
+            content=content,
+            content_type=content_type
+        ) for subject, content in rendered]
+
+    for email, digests in digests_by_email.items():
+        subject, content = renderer.render_combined_digest(
+            digests=digests,
+            template=TEMPLATES[content_type]['combined_digest_template']
+        )
+
+        # a combined message belongs to no single subscription
+        messages.append(NewMessage(
+            subscription_id=digests[0]['subscription_id'] if len(
+                digests) == 1 else None,
+            email=email,
+            subject=subject,
+            content=content,
+            content_type=content_type
+        ))
+
+    if renderer.render_cache:
+        renderer.render_cache.save()
+        run.count('render_cache_hits', renderer.render_cache.hits)
+        run.count('render_cache_misses', renderer.render_cache.misses)
+
+    run.add_time('render', time.perf_counter() - started)
+
+    started = time.perf_counter()
+    crud.queue_messages(session.db, {subscription_id: max(a.article_id for a in articles)
+                                     for subscription_id, articles in pending.items()}, messages)
+    run.add_time('queue', time.perf_counter() - started)
+
+
+def create_mailer(session: Session, run: Optional[metrics.RunMetrics] = None) -> 'Mailer':
+    from feedmailer.mailer import Mailer
+
+    config = session.config
+
+    return Mailer(
+        host=config['smtp_host'],
+        port=config['smtp_port'],
+        user=config['smtp_user'],
+        password=config['smtp_password'],
+        auth=config['smtp_auth'],
+        ssl=config['smtp_ssl'],
+        max_messages=config['smtp_max_messages'],
+        templates=session.templates,
+        metrics=run
+    )
+
+
+# Send every message in the outbox which is due. Failed messages are
+# retried with an exponential backoff on later runs until they run out
+# of attempts. Sending is recorded into run when given, otherwise the
+# metrics of the outbox run are written once something was sent.
+def send_outbox(session: Session, args: argparse.Namespace = None, run: Optional[metrics.RunMetrics] = None):
+    from feedmailer import outbox
+
+    config = session.config
+    owns_run = run is None
+    run = run or metrics.RunMetrics('outbox')
+
+    if args and args.retry_dead:
+        crud.retry_dead_messages(session.db)
+
+    messages = crud.find_due_messages(session.db)
+    num_sent = 0
+
+    if not messages:
+        return num_sent
+
+    started = time.perf_counter()
+
+    results = outbox.send_messages(
+        messages,
+        lambda: create_mailer(session, run),
+        config['outbox_workers']
+    )
+
+    for message, error in results:
+        if not error:
+            crud.set_message_sent(session.db, message.message_id)
+            num_sent += 1
+            continue
+
+        run.count('messages_failed')
+
+        delay = outbox.retry_delay(
+            message.attempts + 1,
+            config['outbox_max_attempts'],
+            config['outbox_retry_delay']
+        )
+
+        crud.set_message_failed(
+            session.db, message.message_id, str(error), delay)
+
+        if delay is None:
+            session.logger.error(
+                f"Giving up on sending '{message.subject}' to {message.email}: {error}")
+        else:
+            session.logger.warning(
+                f"Unable to send '{message.subject}' to {message.email}, retrying in {delay:.0f}s: {error}")
+
+    run.add_time('send', time.perf_counter() - started)
+    run.count('messages', len(messages))
+    run.count('messages_sent', num_sent)
+
+    if owns_run:
+        finish_run(session, run)
+
+    session.logger.info(f"Sent {num_sent} of {len(messages)} message(s)")
+
+    return num_sent
+
+
+# Log the phase timings of a run when profiling and write its metrics
+def finish_run(session: Session, run: metrics.RunMetrics):
+    run.finish()
+
+    if session.profile:
+        session.logger.info(
+            f"Time spent in each phase of the {run.name} run, which took {run.duration:.2f}s:")
+
+        for phase, seconds in metrics.phase_times(run).items():
+            session.logger.info(f"    {phase:<24} {seconds:>8.3f}s")
+
+    if not session.config['metrics']:
+        return
+
+    try:
+        metrics.write(run, APP_METRICS_DIR, session.config['metrics'])
+    except OSError as e:
+        session.logger.warning(f"Unable to write metrics: {e}")
+
+
+def set_interval(session: Session, args: argparse.Namespace):
+    if args.seconds is not None and args.seconds <= 0:
+        session.logger.error("The interval must be a positive number of seconds.")
+        return
+
+    if args.kind == 'feed':
+        if not crud.find_feed_by_id(session.db, args.id):
+            session.logger.error(f"No feed exists with id of {args.id}")
+            return
+
+        crud.set_refresh_interval(session.db, args.id, args.seconds)
+    else:
+        if not crud.find_subscription_by_id(session.db, args.id):
+            session.logger.error(
+                f"No subscription exists with id of {args.id}")
+            return
+
+        crud.set_delivery_interval(session.db, args.id, args.seconds)
+
+
+# Delete articles which fall outside the retention policy. Articles which
+# have yet to be delivered to every subscription of their feed are always
+# kept. Sent messages are deleted once they are older than retention_days.
+def prune_database(session: Session, args: argparse.Namespace = None):
+    config = session.config
+    days = args.days if args else config['retention_days']
+    per_feed = args.per_feed if args else config['retention_per_feed']
+
+    if days < 0 or per_feed < 0:
+        session.logger.error("The number of days and articles to keep can not be negative.")
+        return
+
+    started = time.perf_counter()
+
+    num_articles = crud.prune_articles(
+        session.db,
+        max_age_days=days,
+        keep_per_feed=per_feed,
+        batch_size=config['prune_batch_size']
+    )
+
+    num_messages = 0
+
+    if days:
+        num_messages = crud.prune_sent_messages(
+            session.db, days, config['prune_batch_size'])
+
+    if config['auto_vacuum']:
+        if database.enable_incremental_vacuum(session.db):
+            session.logger.info("Enabled incremental vacuuming of the database")
+
+        database.incremental_vacuum(session.db)
+
+    if args and args.vacuum:
+        database.vacuum(session.db)
+
+    elapsed = time.perf_counter() - started
+    session.logger.info(
+        f"Pruned {num_articles} article(s) and {num_messages} sent message(s) in {elapsed:.2f}s")
+
+    return num_articles
+
+
+# Refresh feeds and deliver subscriptions whenever their interval has
+# passed, reusing the same session between runs. SIGTERM and SIGINT let
+# the current run finish before stopping.
+def run_daemon(session: Session, args: argparse.Namespace):
+    config = session.config
+    stopping = threading.Event()
+
+    def stop(signum, frame):
+        session.logger.info("Stopping once the current run finishes")
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    session.logger.info(
+        f"Daemon started, checking for due feeds and subscriptions every {args.poll_interval:g}s")
+
+    # worker processes are started once rather than for every refresh
+    pool = None
+
+    if args.workers > 0:
+        from feedmailer import workers
+
+        pool = workers.create_pool(args.workers, APP_DB_FILE)
+
+    while not stopping.is_set():
+        # a failed run is logged and the daemon carries on, anything left
+        # due is tried again on a later poll
+        try:
+            feeds = crud.find_due_feeds(session.db)
+
+            if feeds:
+                refresh_feeds(session, args, feeds, pool)
+
+                if config['prune_after_refresh']:
+                    prune_database(session)
+        except Exception:
+            session.db.rollback()
+            session.logger.exception("Refreshing feeds failed")
+
+        if stopping.is_set():
+            break
+
+        try:
+            subscription_ids = crud.find_due_subscription_ids(
+                session.db, config['delivery_interval'])
+
+            if subscription_ids:
+                deliver_subscriptions(session, argparse.Namespace(
+                    subscription_ids=subscription_ids,
+                    all=False,
+                    pretend=False,
+                    combine_digests=config['combine_digests']
+                ))
+                crud.set_checked_delivery_at(session.db, subscription_ids)
+            else:
+                send_outbox(session)
+        except Exception:
+            session.db.rollback()
+            session.logger.exception("Delivering subscriptions failed")
+
+        stopping.wait(args.poll_interval)
+
+    if pool:
+        pool.shutdown()
+
+    session.logger.info("Daemon stopped")
 
 
 def cli(args=None):
+    config = init_config()
+
+    # arguments are parsed before opening the database so --help and
+    # mistakes in arguments return straight away
+    parser = init_arg_parser(config)
+    parsed_args = parser.parse_args(args)
+
+    if not parsed_args.command:
+        parser.print_help()
+        return None
+
     session = Session(
         logger=init_logger(),
-        config=init_config(),
-        db=init_db()
+        config=config,
+        db=init_db(),
+        profile=parsed_args.profile is not None
     )
 
-    parser = init_arg_parser(session)
-    parsed_args = parser.parse_args(args)
+    if session.profile:
+        results = profile_command(session, parser, parsed_args)
+    else:
+        results = run_command(session, parser, parsed_args)
+
+    session.db.close()
+
+    return results
+
+
+# Run a command under cProfile. The profile is written to the path given
+# to --profile, or a new file in APP_PROFILE_DIR, and can be inspected
+# with pstats or tools such as snakeviz. Only the main thread is
+# profiled, so work done by the fetch and send workers is covered by the
+# phase timings instead.
+def profile_command(session: Session, parser: argparse.ArgumentParser, args: argparse.Namespace):
+    import cProfile
+    import pstats
+
+    path = args.profile or os.path.join(
+        APP_PROFILE_DIR, f"{args.command}-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    profiler = cProfile.Profile()
+
+    try:
+        return profiler.runcall(run_command, session, parser, args)
+    finally:
+        profiler.dump_stats(path)
+
+        stats = pstats.Stats(profiler).sort_stats(pstats.SortKey.TIME)
+        stats.print_stats(PROFILE_TOP_FUNCTIONS)
+
+        session.logger.info(f"Profile written to {path}")
+
+
+def run_command(session: Session, parser: argparse.ArgumentParser, parsed_args: argparse.Namespace):
     results = None
 
     if parsed_args.command == 'add':
@@ -393,14 +1502,29 @@ def cli(args=None):
         results = remove_subscription(session, parsed_args)
     elif parsed_args.command == 'deliver':
         results = deliver_subscriptions(session, parsed_args)
+    elif parsed_args.command == 'outbox':
+        results = send_outbox(session, parsed_args)
+    elif parsed_args.command == 'daemon':
+        results = run_daemon(session, parsed_args)
+    elif parsed_args.command == 'set-interval':
+        results = set_interval(session, parsed_args)
     elif parsed_args.command == 'refresh':
         if parsed_args.feed_id:
             results = refresh_feed(session, parsed_args)
+        elif parsed_args.worker_id or parsed_args.shard:
+            results = refresh_leased_feeds(session, parsed_args)
         else:
-            results = refresh_feeds(session)
+            results = refresh_feeds(session, parsed_args)
+
+        if session.config['prune_after_refresh']:
+            prune_database(session)
+    elif parsed_args.command == 'prune':
+        results = prune_database(session, parsed_args)
+    elif parsed_args.command == 'import':
+        results = import_feeds(session, parsed_args)
+    elif parsed_args.command == 'export':
+        results = export_feeds(session, parsed_args)
     else:
         parser.print_help()
 
-    session.db.close()
-
     return results
@@ -1,9 +1,53 @@
 
 from datetime import datetime
-from typing import Optional, List, TypedDict
-from sqlite3 import Connection
+from typing import Dict, Iterator, Optional, List, Set, Tuple, TypedDict
+from sqlite3 import Connection, Cursor
 
-from .types import Article, Feed, FeedsFilter, NewArticle, NewSubscription, Subscription, SubscriptionsFilter
+from .types import Article, Feed, FeedRefresh, FeedsFilter, Message, NewArticle, NewMessage, NewSubscription, Subscription, SubscriptionsFilter
+
+# number of refreshes kept in the history of each feed
+FEED_REFRESHES_KEPT = 100
+
+# urls and guids looked up by each query of find_known_entries
+KNOWN_ENTRIES_CHUNK_SIZE = 500
+
+# selected in the order of the Feed fields
+FEED_COLUMNS = ("f.feed_id, f.title, f.created_at, f.refreshed_at, f.updated_at, f.url, "
+                "f.etag, f.last_modified, f.content_hash, f.refresh_interval, f.next_refresh_at, "
+                "f.empty_refreshes, f.failed_refreshes, f.hint_interval")
+
+# Condition on an article `a` of a subscription `s` which it has yet to
+# be delivered. Articles are delivered in the order they were stored,
+# as an entry can be stored well after it was published, except ones
+# published before the subscription was made. The unary + keeps sqlite
+# seeking by article_id rather than by date.
+NOT_DELIVERED = "a.article_id > s.delivered_article_id AND +a.effective_at > s.created_at"
+
+# Condition on an article `a` of a subscription `s` which skips articles
+# whose guid was stored earlier in another feed the same email is
+# subscribed to, since that copy is delivered instead. Copies published
+# before that subscription was made are never delivered so do not count.
+NOT_DELIVERED_ELSEWHERE = ("(a.guid IS NULL OR NOT EXISTS (SELECT 1 FROM articles d "
+                           "INNER JOIN subscriptions ds ON ds.feed_id = d.feed_id "
+                           "WHERE d.guid = a.guid AND d.article_id < a.article_id "
+                           "AND d.feed_id != a.feed_id AND ds.email = s.email "
+                           "AND d.effective_at > ds.created_at))")
+
+
+# Row factory building records of cls straight from the values of a row,
+# whose columns must be selected in the order of cls's fields. This
+# skips creating a sqlite3.Row for every row only to copy it.
+def record_factory(cls):
+    return lambda cursor, row: cls(*row)
+
+
+# Yield the rows of a cursor which was executed, closing it once they
+# run out
+def iter_rows(cur: Cursor) -> Iterator:
+    try:
+        yield from cur
+    finally:
+        cur.close()
 
 
 def find_feeds(conn: Connection, **kwargs: FeedsFilter) -> List[Feed]:
@@ -12,21 +56,95 @@ def find_feeds(conn: Connection, **kwargs: FeedsFilter) -> List[Feed]:
     url = kwargs.get('url', None)
 
     # only return distinct feeds which users are subscribed to
-    query = ("SELECT DISTINCT f.created_at, f.feed_id, f.title, f.updated_at, f.url, f.refreshed_at FROM feeds f "
+    query = ("SELECT DISTINCT " + FEED_COLUMNS + " FROM feeds f "
              "INNER JOIN subscriptions s ON f.feed_id = s.feed_id "
              "WHERE f.feed_id = COALESCE(?, f.feed_id) AND f.title = COALESCE(?, f.title) AND f.url = COALESCE(?, f.url);")
 
     cur = conn.cursor()
+    cur.row_factory = record_factory(Feed)
     cur.execute(query, (feed_id, title, url))
-    rows = cur.fetchall()
+    feeds = cur.fetchall()
     cur.close()
 
-    return [Feed(**row) for row in rows]
+    return feeds
 
 
 def find_feed_by_id(conn: Connection, feed_id: int) -> Feed | None:
     results = find_feeds(conn, feed_id=feed_id)
-    return Feed(**results[0]) if len(results) else None
+    return results[0] if len(results) else None
+
+
+# Subscribed feeds which are due to be refreshed
+def find_due_feeds(conn: Connection) -> List[Feed]:
+    query = ("SELECT DISTINCT " + FEED_COLUMNS + " FROM feeds f "
+             "INNER JOIN subscriptions s ON f.feed_id = s.feed_id "
+             "WHERE f.next_refresh_at IS NULL OR f.next_refresh_at <= CURRENT_TIMESTAMP;")
+
+    cur = conn.cursor()
+    cur.row_factory = record_factory(Feed)
+    cur.execute(query)
+    feeds = cur.fetchall()
+    cur.close()
+
+    return feeds
+
+
+# Claim up to limit due feeds for worker_id until lease_seconds from
+# now, skipping feeds another worker holds an unexpired lease on. Only
+# feeds whose id modulo shard_count is shard_index are claimed, so
+# workers given different shards never compete for the same feeds.
+# Feeds are claimed with a single statement so two workers can never
+# claim the same feed.
+def claim_feeds(conn: Connection, worker_id: str, limit: int, lease_seconds: int, shard_index: int = 0, shard_count: int = 1) -> List[Feed]:
+    claim = ("INSERT INTO feed_leases(feed_id, worker_id, expires_at) "
+             "SELECT f.feed_id, :worker_id, DATETIME(CURRENT_TIMESTAMP, '+' || :lease_seconds || ' seconds') "
+             "FROM feeds f "
+             "WHERE (f.next_refresh_at IS NULL OR f.next_refresh_at <= CURRENT_TIMESTAMP) "
+             "AND f.feed_id % :shard_count = :shard_index "
+             "AND EXISTS (SELECT 1 FROM subscriptions s WHERE s.feed_id = f.feed_id) "
+             "AND NOT EXISTS (SELECT 1 FROM feed_leases l WHERE l.feed_id = f.feed_id "
+             "AND l.worker_id != :worker_id AND l.expires_at > CURRENT_TIMESTAMP) "
+             "ORDER BY f.next_refresh_at LIMIT :limit "
+             "ON CONFLICT(feed_id) DO UPDATE SET worker_id = excluded.worker_id, expires_at = excluded.expires_at "
+             "RETURNING feed_id;")
+
+    cur = conn.cursor()
+    cur.execute(claim, {'worker_id': worker_id, 'lease_seconds': lease_seconds, 'limit': limit,
+                        'shard_index': shard_index, 'shard_count': shard_count})
+    feed_ids = [row['feed_id'] for row in cur.fetchall()]
+    conn.commit()
+
+    if not feed_ids:
+        cur.close()
+        return []
+
+    cur.row_factory = record_factory(Feed)
+    cur.execute("SELECT " + FEED_COLUMNS + " FROM feeds f WHERE f.feed_id IN ({});".format(
+        ", ".join("?" * len(feed_ids))), feed_ids)
+    feeds = cur.fetchall()
+    cur.close()
+
+    return feeds
+
+
+# Extend the leases worker_id holds on feeds to lease_seconds from now
+def renew_leases(conn: Connection, worker_id: str, feed_ids: List[int], lease_seconds: int):
+    query = ("UPDATE feed_leases SET expires_at = DATETIME(CURRENT_TIMESTAMP, '+' || ? || ' seconds') "
+             "WHERE worker_id = ? AND feed_id = ?;")
+    cur = conn.cursor()
+
+    cur.executemany(query, ((lease_seconds, worker_id, i) for i in feed_ids))
+    conn.commit()
+    cur.close()
+
+
+def release_leases(conn: Connection, worker_id: str, feed_ids: List[int]):
+    query = "DELETE FROM feed_leases WHERE worker_id = ? AND feed_id = ?;"
+    cur = conn.cursor()
+
+    cur.executemany(query, ((worker_id, i) for i in feed_ids))
+    conn.commit()
+    cur.close()
 
 
 def find_subscriptions(conn: Connection, **kwargs: SubscriptionsFilter) -> List[Subscription]:
@@ -35,27 +153,30 @@ def find_subscriptions(conn: Connection, **kwargs: SubscriptionsFilter) -> List[
     url = kwargs.get('url', None)
     email = kwargs.get('email', None)
 
-    query = ("""SELECT f.feed_id, 
-                        f.title, 
-                        f.url, 
-                        f.refreshed_at, 
-                        s.subscription_id, 
-                        s.email, 
-                        s.attempted_delivery_at, 
-                        s.digest, 
-                        s.created_at, 
-                        s.updated_at, 
-                        s.desc_length 
+    # selected in the order of the Subscription fields
+    query = ("""SELECT s.subscription_id,
+                        s.desc_length,
+                        s.email,
+                        f.feed_id,
+                        s.digest,
+                        s.attempted_delivery_at,
+                        f.title,
+                        f.url,
+                        s.created_at,
+                        s.updated_at,
+                        f.refreshed_at,
+                        s.delivery_interval
              FROM subscriptions s """
              "INNER JOIN feeds f ON s.feed_id = f.feed_id "
              "WHERE s.subscription_id = COALESCE(?, s.subscription_id) AND f.title = COALESCE(?, f.title) AND f.url = COALESCE(?, f.url) AND s.email = COALESCE(?, email);")
 
     cur = conn.cursor()
+    cur.row_factory = record_factory(Subscription)
     cur.execute(query, (subscription_id, title, url, email))
-    rows = cur.fetchall()
+    subscriptions = cur.fetchall()
     cur.close()
 
-    return [Subscription(**row) for row in rows]
+    return subscriptions
 
 
 def find_subscription_by_id(conn, subscription_id) -> Subscription | None:
@@ -63,46 +184,69 @@ def find_subscription_by_id(conn, subscription_id) -> Subscription | None:
     return results[0] if len(results) else None
 
 
+# Ids of subscriptions whose delivery interval has passed since they
+# were last checked for articles to deliver
+def find_due_subscription_ids(conn: Connection, default_interval: int) -> List[int]:
+    query = ("SELECT subscription_id FROM subscriptions "
+             "WHERE checked_delivery_at IS NULL "
+             "OR DATETIME(checked_delivery_at, '+' || COALESCE(delivery_interval, ?) || ' seconds') <= CURRENT_TIMESTAMP;")
+
+    cur = conn.cursor()
+    cur.execute(query, (default_interval,))
+    rows = cur.fetchall()
+    cur.close()
+
+    return [row['subscription_id'] for row in rows]
+
+
+def set_refresh_interval(conn: Connection, feed_id: int, interval: Optional[int]):
+    cur = conn.cursor()
+
+    cur.execute("UPDATE feeds SET refresh_interval = ?, updated_at = CURRENT_TIMESTAMP WHERE feed_id = ?;",
+                (interval, feed_id))
+    conn.commit()
+    cur.close()
+
+
+def set_delivery_interval(conn: Connection, subscription_id: int, interval: Optional[int]):
+    cur = conn.cursor()
+
+    cur.execute("UPDATE subscriptions SET delivery_interval = ?, updated_at = CURRENT_TIMESTAMP WHERE subscription_id = ?;",
+                (interval, subscription_id))
+    conn.commit()
+    cur.close()
+
+
 # Add a subscription to a feed, if the feed does not exist
 # then it will be created and subscribed to
 
 def add_subscription(conn, **kwargs: NewSubscription):
-    cur = conn.cursor()
-
-    temp_table_sql = ("CREATE TEMP TABLE temp_subs("
-                      "title VARCHAR NOT NULL,"
-                      "url VARCHAR NOT NULL,"
-                      "email VARCHAR NOT NULL,"
-                      "digest BOOLEAN,"
-                      "desc_length INT"
-                      ");")
-    insert_into_temp_sql = ("INSERT INTO temp_subs(title, url, email, digest, desc_length)"
-                            "VALUES (?, ?, ?, ?, ?);")
+    add_subscriptions(conn, [kwargs])
 
-    add_feed_sql = ("INSERT INTO feeds(title, url, created_at) "
-                    "SELECT t.title, t.url, CURRENT_TIMESTAMP FROM temp_subs t "
-                    "LEFT JOIN feeds f ON t.url = f.url "
-                    "WHERE f.feed_id IS NULL;")
 
-    add_subscription_sql = ("INSERT INTO subscriptions(feed_id, email, digest, desc_length, created_at) "
-                            "SELECT f.feed_id, t.email, t.digest, desc_length, CURRENT_TIMESTAMP FROM temp_subs t "
-                            "INNER JOIN feeds f ON t.url = f.url;")
+# Add many subscriptions within one transaction, creating the feeds
+# which don't exist yet. Subscriptions an email already has to a feed
+# are skipped. Returns the number of subscriptions added.
+def add_subscriptions(conn: Connection, subscriptions: List[NewSubscription]) -> int:
+    add_feed_sql = ("INSERT INTO feeds(title, url, created_at) VALUES (?, ?, CURRENT_TIMESTAMP) "
+                    "ON CONFLICT(url) DO NOTHING;")
 
-    values = (
-        kwargs['title'],
-        kwargs['url'],
-        kwargs['email'],
-        kwargs['digest'],
-        kwargs['desc_length']
-    )
+    # only articles stored from now on are delivered
+    add_subscription_sql = ("INSERT INTO subscriptions(feed_id, email, digest, desc_length, delivered_article_id, created_at) "
+                            "SELECT f.feed_id, ?, ?, ?, (SELECT COALESCE(MAX(article_id), 0) FROM articles), CURRENT_TIMESTAMP "
+                            "FROM feeds f WHERE f.url = ? "
+                            "AND NOT EXISTS (SELECT 1 FROM subscriptions s WHERE s.feed_id = f.feed_id AND s.email = ?);")
 
-    cur.execute(temp_table_sql)
-    cur.execute(insert_into_temp_sql, values)
-    cur.execute(add_feed_sql)
-    cur.execute(add_subscription_sql)
+    cur = conn.cursor()
+    cur.executemany(add_feed_sql, ((s['title'], s['url']) for s in subscriptions))
+    cur.executemany(add_subscription_sql, ((s['email'], s['digest'], s['desc_length'], s['url'], s['email'])
+                                           for s in subscriptions))
+    num_added = max(cur.rowcount, 0)
     conn.commit()
     cur.close()
 
+    return num_added
+
 
 def remove_subscription(conn: Connection, subscription_id: int):
     cur = conn.cursor()
@@ -116,67 +260,445 @@ def remove_subscription(conn: Connection, subscription_id: int):
 # Insert articles which do not already exist
 # for a feed
 def refresh_articles(conn: Connection, feed_id: int, articles: List[NewArticle]) -> int:
-    create_temp_table = ("CREATE TEMP TABLE temp_articles ("
-                         "url VARCHAR NOT NULL,"
-                         "title VARCHAR NOT NULL,"
-                         "author VARCHAR NULL, "
-                         "feed_id INTEGER NOT NULL,"
-                         "description TEXT NULL,"
-                         "published_at DATETIME);")
+    return refresh_articles_bulk(conn, {feed_id: articles})[feed_id]
+
+
+# Insert articles of many feeds which do not already exist within a
+# single transaction. Returns the number of new articles of each feed.
+def refresh_articles_bulk(conn: Connection, articles_by_feed: Dict[int, List[NewArticle]]) -> Dict[int, int]:
+    # articles already stored at the same url or with the same guid are
+    # skipped
+    insert_articles = ("INSERT INTO articles (url, title, author, feed_id, description, published_at, guid, created_at) "
+                       "VALUES (?, ?, ?, ?, ?, DATETIME(?, 'UTC'), ?, CURRENT_TIMESTAMP) "
+                       "ON CONFLICT DO NOTHING;")
+    # as are ones which were pruned, only checked for feeds which had
+    # articles pruned
+    insert_unpruned_articles = ("INSERT INTO articles (url, title, author, feed_id, description, published_at, guid, created_at) "
+                                "SELECT ?1, ?2, ?3, ?4, ?5, DATETIME(?6, 'UTC'), ?7, CURRENT_TIMESTAMP "
+                                "WHERE NOT EXISTS (SELECT 1 FROM pruned_articles WHERE feed_id = ?4 AND url = ?1) "
+                                "AND NOT EXISTS (SELECT 1 FROM pruned_articles WHERE feed_id = ?4 AND guid = ?7) "
+                                "ON CONFLICT DO NOTHING;")
+    update_feed = "UPDATE feeds SET refreshed_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP WHERE feed_id = ?;"
+
+    num_merged = {}
+    cur = conn.cursor()
+
+    for feed_id, articles in articles_by_feed.items():
+        values = [(a['url'], a['title'], a['author'], feed_id, a['description'], a['published_at'], a['guid'])
+                  for a in articles]
 
-    insert_into_temp = "INSERT INTO temp_articles (url, title, author, feed_id, description, published_at) VALUES (?, ?, ?, ?, ?, ?);"
+        cur.execute(update_feed, (feed_id,))
 
-    merge_temp = "INSERT INTO articles (url, title, author, feed_id, description, published_at, created_at) SELECT t.url, t.title, t.author, t.feed_id, t.description, DATETIME(t.published_at, 'UTC'), CURRENT_TIMESTAMP FROM temp_articles AS t LEFT JOIN articles AS a ON t.feed_id = a.feed_id AND t.url = a.url WHERE a.article_id IS NULL;"
+        if not values:
+            num_merged[feed_id] = 0
+            continue
 
-    values = list(map((lambda a: (a['url'], a['title'], a['author'],
-                  feed_id, a['description'], a['published_at'])), articles))
+        cur.executemany(insert_unpruned_articles if has_pruned_articles(conn, feed_id) else insert_articles,
+                        values)
+        num_merged[feed_id] = max(cur.rowcount, 0)
 
+    conn.commit()
+    cur.close()
+
+    return num_merged
+
+
+def has_pruned_articles(conn: Connection, feed_id: int) -> bool:
     cur = conn.cursor()
+    cur.execute("SELECT EXISTS (SELECT 1 FROM pruned_articles WHERE feed_id = ?) AS pruned;", (feed_id,))
+    pruned = cur.fetchone()['pruned']
+    cur.close()
 
-    cur.execute(
-        "UPDATE feeds SET refreshed_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP WHERE feed_id = ?;", (feed_id,))
-    cur.execute(create_temp_table)
-    cur.executemany(insert_into_temp, values)
-    cur.execute(merge_temp)
+    return bool(pruned)
 
-    conn.commit()
 
-    num_merged = cur.rowcount
+# Forget the pruned articles of a feed which it no longer lists, given
+# the urls and guids of every entry it lists now. Once gone from the
+# feed they can't be stored again, so they are only remembered while
+# listed. Returns the number of pruned articles forgotten.
+def forget_pruned_articles(conn: Connection, feed_id: int, urls: Set[str], guids: Set[str]) -> int:
+    cur = conn.cursor()
+    cur.execute("SELECT rowid, url, guid FROM pruned_articles WHERE feed_id = ?;", (feed_id,))
+    unlisted = [(row['rowid'],) for row in cur.fetchall()
+                if row['url'] not in urls and row['guid'] not in guids]
 
-    cur.execute("DROP TABLE temp_articles;")
+    cur.executemany("DELETE FROM pruned_articles WHERE rowid = ?;", unlisted)
     conn.commit()
     cur.close()
 
-    return num_merged
+    return len(unlisted)
+
+
+# Urls and guids of a feed's articles which are already stored or were
+# pruned, out of those given. Values are looked up in chunks to stay
+# below sqlite's limit on the number of parameters of a query.
+def find_known_entries(conn: Connection, feed_id: int, urls: List[str], guids: List[str]) -> Tuple[Set[str], Set[str]]:
+    known_urls = set()
+    known_guids = set()
+    cur = conn.cursor()
+
+    for i in range(0, max(len(urls), len(guids)), KNOWN_ENTRIES_CHUNK_SIZE):
+        url_chunk = urls[i:i + KNOWN_ENTRIES_CHUNK_SIZE]
+        guid_chunk = guids[i:i + KNOWN_ENTRIES_CHUNK_SIZE]
+        urls_in = ", ".join("?" * len(url_chunk))
+        guids_in = ", ".join("?" * len(guid_chunk))
+        # a union lets each part seek through its own index
+        query = ("SELECT url, guid FROM articles WHERE feed_id = ? AND url IN ({urls}) "
+                 "UNION SELECT url, guid FROM articles WHERE feed_id = ? AND guid IN ({guids}) "
+                 "UNION SELECT url, guid FROM pruned_articles WHERE feed_id = ? AND url IN ({urls}) "
+                 "UNION SELECT url, guid FROM pruned_articles WHERE feed_id = ? AND guid IN ({guids});").format(
+            urls=urls_in, guids=guids_in)
+
+        cur.execute(query, (feed_id, *url_chunk, feed_id, *guid_chunk,
+                            feed_id, *url_chunk, feed_id, *guid_chunk))
+
+        for row in cur.fetchall():
+            known_urls.add(row['url'])
+            known_guids.add(row['guid'])
+
+    cur.close()
 
+    return known_urls, known_guids
+
+
+# Publish times of a feed's most recent articles, newest first
+def find_recent_publish_times(conn: Connection, feed_id: int, limit: int) -> List[datetime]:
+    query = ("SELECT effective_at FROM articles WHERE feed_id = ? "
+             "ORDER BY effective_at DESC LIMIT ?;")
 
-def find_articles_for_delivery(conn: Connection, subscription_id: int) -> List[Article]:
     cur = conn.cursor()
+    cur.execute(query, (feed_id, limit))
+    rows = cur.fetchall()
+    cur.close()
+
+    return [datetime.fromisoformat(row['effective_at']) for row in rows if row['effective_at']]
+
+
+# Record how the refresh of many feeds went within a single transaction.
+# This stores the validators of each feed's response, schedules its next
+# refresh in `interval` seconds and adds the refresh to its history. A
+# hint_interval of None keeps the feed's current one.
+def record_refreshes(conn: Connection, refreshes: List[FeedRefresh]):
+    insert_refresh = ("INSERT INTO feed_refreshes(feed_id, status, new_articles, refreshed_at) "
+                      "VALUES (:feed_id, :status, :new_articles, CURRENT_TIMESTAMP);")
+    prune_refreshes = ("DELETE FROM feed_refreshes WHERE feed_id = :feed_id AND refresh_id <= "
+                       "(SELECT refresh_id FROM feed_refreshes WHERE feed_id = :feed_id "
+                       "ORDER BY refresh_id DESC LIMIT 1 OFFSET :kept);")
+    update_feed = ("UPDATE feeds SET "
+                   "etag = :etag, last_modified = :last_modified, content_hash = :content_hash, "
+                   "refreshed_at = CASE WHEN :status = 'error' THEN refreshed_at ELSE CURRENT_TIMESTAMP END, "
+                   "next_refresh_at = DATETIME(CURRENT_TIMESTAMP, '+' || :interval || ' seconds'), "
+                   "empty_refreshes = :empty_refreshes, failed_refreshes = :failed_refreshes, "
+                   "hint_interval = COALESCE(:hint_interval, hint_interval) "
+                   "WHERE feed_id = :feed_id;")
+
+    cur = conn.cursor()
+    cur.executemany(insert_refresh, refreshes)
+    cur.executemany(prune_refreshes, (dict(r, kept=FEED_REFRESHES_KEPT)
+                                      for r in refreshes))
+    cur.executemany(update_feed, refreshes)
+    conn.commit()
+    cur.close()
+
+
+# Articles are read from the database as they are iterated over
+def find_articles_for_delivery(conn: Connection, subscription_id: int) -> Iterator[Article]:
+    cur = conn.cursor()
+    cur.row_factory = record_factory(Article)
+    # columns are selected in the order of the Article fields
     query = ("SELECT "
              "a.article_id,"
              "a.title,"
              "a.url,"
-             "a.published_at,"
              "a.author,"
+             "a.feed_id,"
+             "a.category,"
              "a.description,"
-             "a.feed_id "
+             "a.published_at,"
+             "a.created_at,"
+             "a.updated_at,"
+             "a.guid "
              "FROM subscriptions s "
              "INNER JOIN articles a ON s.feed_id = a.feed_id "
              "WHERE s.subscription_id = ? "
-             "AND COALESCE(a.published_at, a.created_at) > COALESCE(s.attempted_delivery_at, s.created_at); ")
+             "AND " + NOT_DELIVERED + " "
+             "AND " + NOT_DELIVERED_ELSEWHERE + ";")
 
     cur.execute(query, (subscription_id,))
     conn.commit()
-    rows = cur.fetchall()
-    cur.close()
 
-    return [Article(**row) for row in rows]
+    return iter_rows(cur)
+
+
+# Find articles to deliver for many subscriptions with a single query.
+# Yields (subscription_id, article) pairs ordered by subscription and
+# then by date, read from the database as they are iterated over. Every
+# subscription is included when no ids are given.
+def find_pending_deliveries(conn: Connection, subscription_ids: Optional[List[int]] = None) -> Iterator[Tuple[int, Article]]:
+    cur = conn.cursor()
+    cur.row_factory = lambda cursor, row: (row[0], Article(*row[1:]))
+    params = ()
+    id_filter = ""
 
+    if subscription_ids is not None:
+        params = tuple(subscription_ids)
+        id_filter = "AND s.subscription_id IN ({}) ".format(
+            ", ".join("?" * len(params)))
 
-def set_attempted_delivery_at(conn: Connection, subscription_id: int):
+    # articles columns are selected in the order of the Article fields
+    query = ("SELECT "
+             "s.subscription_id,"
+             "a.article_id,"
+             "a.title,"
+             "a.url,"
+             "a.author,"
+             "a.feed_id,"
+             "a.category,"
+             "a.description,"
+             "a.published_at,"
+             "a.created_at,"
+             "a.updated_at,"
+             "a.guid "
+             "FROM subscriptions s "
+             "INNER JOIN articles a ON s.feed_id = a.feed_id "
+             "WHERE " + NOT_DELIVERED + " "
+             "AND " + NOT_DELIVERED_ELSEWHERE + " "
+             + id_filter +
+             "ORDER BY s.subscription_id, a.effective_at;")
+
+    cur.execute(query, params)
+
+    return iter_rows(cur)
+
+
+def set_attempted_delivery_at(conn: Connection, subscription_ids: List[int]):
     query = "UPDATE subscriptions SET attempted_delivery_at = CURRENT_TIMESTAMP WHERE subscription_id = ?;"
     cur = conn.cursor()
 
-    cur.execute(query, (subscription_id,))
+    # all subscriptions are updated within one transaction
+    cur.executemany(query, ((i,) for i in subscription_ids))
+    conn.commit()
+    cur.close()
+
+
+# Record that subscriptions were checked for articles to deliver, so
+# they are not due again until their delivery interval has passed
+def set_checked_delivery_at(conn: Connection, subscription_ids: List[int]):
+    query = "UPDATE subscriptions SET checked_delivery_at = CURRENT_TIMESTAMP WHERE subscription_id = ?;"
+    cur = conn.cursor()
+
+    cur.executemany(query, ((i,) for i in subscription_ids))
+    conn.commit()
+    cur.close()
+
+
+# Queue rendered messages and mark their subscriptions as delivered up
+# to the newest article id queued for each, within one transaction so
+# articles are never marked without their messages having been stored.
+# Articles stored since they were found are left for the next delivery.
+def queue_messages(conn: Connection, delivered: Dict[int, int], messages: List[NewMessage]):
+    insert_message = ("INSERT INTO outbox(subscription_id, email, subject, content, content_type, next_attempt_at, created_at) "
+                      "VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP);")
+    update_subscription = ("UPDATE subscriptions SET attempted_delivery_at = CURRENT_TIMESTAMP, "
+                           "delivered_article_id = MAX(delivered_article_id, ?) WHERE subscription_id = ?;")
+
+    values = [(m['subscription_id'], m['email'], m['subject'], m['content'], m['content_type'])
+              for m in messages]
+
+    cur = conn.cursor()
+    cur.executemany(insert_message, values)
+    cur.executemany(update_subscription, ((article_id, subscription_id)
+                                          for subscription_id, article_id in delivered.items()))
+    conn.commit()
+    cur.close()
+
+
+def find_due_messages(conn: Connection) -> List[Message]:
+    query = ("SELECT message_id, subscription_id, email, subject, content, content_type, status, "
+             "attempts, last_error, next_attempt_at, created_at, sent_at FROM outbox "
+             "WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP "
+             "ORDER BY message_id;")
+
+    cur = conn.cursor()
+    cur.row_factory = record_factory(Message)
+    cur.execute(query)
+    messages = cur.fetchall()
+    cur.close()
+
+    return messages
+
+
+def set_message_sent(conn: Connection, message_id: int):
+    query = ("UPDATE outbox SET status = 'sent', attempts = attempts + 1, last_error = NULL, "
+             "sent_at = CURRENT_TIMESTAMP WHERE message_id = ?;")
+    cur = conn.cursor()
+
+    cur.execute(query, (message_id,))
+    conn.commit()
+    cur.close()
+
+
+# Record a failed attempt. The message is retried after retry_delay
+# seconds, or marked as dead when no retry_delay is given.
+def set_message_failed(conn: Connection, message_id: int, error: str, retry_delay: Optional[float]):
+    query = ("UPDATE outbox SET attempts = attempts + 1, last_error = ?, "
+             "status = CASE WHEN ? IS NULL THEN 'dead' ELSE 'pending' END, "
+             "next_attempt_at = DATETIME(CURRENT_TIMESTAMP, '+' || COALESCE(?, 0) || ' seconds') "
+             "WHERE message_id = ?;")
+    cur = conn.cursor()
+
+    cur.execute(query, (error, retry_delay, retry_delay, message_id))
+    conn.commit()
+    cur.close()
+
+
+# Give dead messages another round of attempts
+def retry_dead_messages(conn: Connection) -> int:
+    query = ("UPDATE outbox SET status = 'pending', attempts = 0, "
+             "next_attempt_at = CURRENT_TIMESTAMP WHERE status = 'dead';")
+    cur = conn.cursor()
+
+    cur.execute(query)
+    conn.commit()
+    num_retried = cur.rowcount
+    cur.close()
+
+    return num_retried
+
+
+# Delete old articles in batches of batch_size, committing after every
+# batch so other writers are never locked out for long. Articles
+# published more than max_age_days ago or beyond the newest
+# keep_per_feed of their feed are deleted, except ones which a
+# subscription to their feed has yet to be delivered. The url and guid
+# of each deleted article are kept in pruned_articles, so it is not
+# stored again while its feed still lists it, until a refresh finds it
+# gone. Returns the number of articles deleted.
+def prune_articles(conn: Connection, **kwargs) -> int:
+    cur = conn.cursor()
+    cur.execute("SELECT feed_id FROM feeds;")
+    feed_ids = [row['feed_id'] for row in cur.fetchall()]
+
+    num_deleted = sum(prune_feed_articles(conn, feed_id, **kwargs)
+                      for feed_id in feed_ids)
+
+    # renders of deleted articles
+    cur.execute("DELETE FROM rendered_articles WHERE article_id NOT IN (SELECT article_id FROM articles);")
+    # feeds nobody is subscribed to are no longer refreshed, so their
+    # pruned articles would never be forgotten
+    cur.execute("DELETE FROM pruned_articles WHERE feed_id NOT IN (SELECT feed_id FROM subscriptions);")
+    conn.commit()
+    cur.close()
+
+    return num_deleted
+
+
+def prune_feed_articles(conn: Connection, feed_id: int, **kwargs) -> int:
+    max_age_days = kwargs.get('max_age_days', None)
+    keep_per_feed = kwargs.get('keep_per_feed', None)
+    batch_size = kwargs['batch_size']
+
+    conditions = []
+    params = []
+    cur = conn.cursor()
+
+    if max_age_days:
+        conditions.append("effective_at < DATETIME('now', ?)")
+        params.append(f"-{max_age_days:d} days")
+
+    if keep_per_feed:
+        # the newest article beyond the ones kept
+        cur.execute("SELECT effective_at, article_id FROM articles WHERE feed_id = ? "
+                    "ORDER BY effective_at DESC, article_id DESC LIMIT 1 OFFSET ?;", (feed_id, keep_per_feed))
+        row = cur.fetchone()
+
+        if row:
+            conditions.append("(effective_at, article_id) <= (?, ?)")
+            params.extend((row['effective_at'], row['article_id']))
+
+    if not conditions:
+        cur.close()
+        return 0
+
+    where = "feed_id = ? AND (" + " OR ".join(conditions) + ")"
+    params.insert(0, feed_id)
+
+    # articles still waiting for a subscription are kept, as is the one
+    # a subscription was delivered up to so its id is never reused
+    where += (" AND NOT EXISTS (SELECT 1 FROM subscriptions s WHERE s.feed_id = articles.feed_id "
+              "AND articles.article_id >= s.delivered_article_id AND articles.effective_at > s.created_at)")
+
+    find_batch = "SELECT article_id FROM articles WHERE " + where + " LIMIT ?;"
+    record_pruned = ("INSERT INTO pruned_articles(feed_id, url, guid, pruned_at) "
+                     "SELECT feed_id, url, guid, CURRENT_TIMESTAMP FROM articles WHERE article_id = ? "
+                     "ON CONFLICT DO NOTHING;")
+    delete_article = "DELETE FROM articles WHERE article_id = ?;"
+
+    num_deleted = 0
+
+    while True:
+        cur.execute(find_batch, (*params, batch_size))
+        batch = [(row['article_id'],) for row in cur.fetchall()]
+
+        cur.executemany(record_pruned, batch)
+        cur.executemany(delete_article, batch)
+        conn.commit()
+        num_deleted += len(batch)
+
+        if len(batch) < batch_size:
+            break
+
+    cur.close()
+
+    return num_deleted
+
+
+# Delete messages which were sent more than max_age_days ago, in batches
+# of batch_size. Returns the number of messages deleted.
+def prune_sent_messages(conn: Connection, max_age_days: int, batch_size: int) -> int:
+    query = ("DELETE FROM outbox WHERE message_id IN (SELECT message_id FROM outbox "
+             "WHERE status = 'sent' AND sent_at < DATETIME('now', ?) LIMIT ?);")
+
+    num_deleted = 0
+    cur = conn.cursor()
+
+    while True:
+        cur.execute(query, (f"-{max_age_days:d} days", batch_size))
+        conn.commit()
+        num_deleted += cur.rowcount
+
+        if cur.rowcount < batch_size:
+            break
+
+    cur.close()
+
+    return num_deleted
+
+
+# desc_length stored for renders of whole descriptions, as a NULL in
+# the primary key would never conflict with an earlier render
+NO_DESC_LENGTH = -1
+
+
+def find_rendered_article(conn: Connection, article_id: int, template: str, content_type: str, desc_length: Optional[int]) -> Optional[Tuple[str, str]]:
+    query = ("SELECT subject, content FROM rendered_articles WHERE article_id = ? "
+             "AND template = ? AND content_type = ? AND desc_length = COALESCE(?, {:d});").format(NO_DESC_LENGTH)
+
+    cur = conn.cursor()
+    cur.execute(query, (article_id, template, content_type, desc_length))
+    row = cur.fetchone()
+    cur.close()
+
+    return (row['subject'], row['content']) if row else None
+
+
+# Save renders of (article_id, template, content_type, desc_length,
+# subject, content) within one transaction
+def store_rendered_articles(conn: Connection, renders: List[Tuple]):
+    query = ("INSERT OR REPLACE INTO rendered_articles(article_id, template, content_type, desc_length, "
+             "subject, content, created_at) VALUES (?, ?, ?, COALESCE(?, {:d}), ?, ?, CURRENT_TIMESTAMP);").format(NO_DESC_LENGTH)
+    cur = conn.cursor()
+
+    cur.executemany(query, renders)
     conn.commit()
     cur.close()
@@ -1,12 +1,35 @@
 import sqlite3
+from urllib.parse import quote
+
+# user_version of a database once every migration below has ran
+SCHEMA_VERSION = 15
+
+# Seconds a connection waits on another process writing to the database
+# before giving up with "database is locked"
+BUSY_TIMEOUT = 60
 
 
 def connect(location: str) -> sqlite3.Connection:
-    conn = sqlite3.connect(location)
+    conn = sqlite3.connect(location, timeout=BUSY_TIMEOUT)
 
     # Return rows as a dictionary instead of as a tuple of values
     conn.row_factory = sqlite3.Row
 
+    # WAL lets readers work alongside a writer, and only needs to sync
+    # on checkpoints when synchronous is NORMAL
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+
+    return conn
+
+
+# Connection which can only read, used by processes working alongside
+# the one writing
+def connect_read_only(location: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(f"file:{quote(location)}?mode=ro", uri=True, timeout=BUSY_TIMEOUT)
+    conn.row_factory = sqlite3.Row
+
     return conn
 
 
@@ -22,6 +45,11 @@ def get_user_version(conn: sqlite3.Connection) -> str:
 
 def setup_db(conn: sqlite3.Connection):
     version = get_user_version(conn)
+
+    # the common case of an up to date database needs no transaction
+    if version == SCHEMA_VERSION:
+        return
+
     cur = conn.cursor()
 
     if version == 0:
@@ -71,7 +99,229 @@ def setup_db(conn: sqlite3.Connection):
             "ALTER TABLE subscriptions ADD COLUMN desc_length INTEGER DEFAULT 255")
         version += 1
 
+    if version == 2:
+        # validators used to conditionally request feeds
+        cur.execute("ALTER TABLE feeds ADD COLUMN etag VARCHAR NULL")
+        cur.execute("ALTER TABLE feeds ADD COLUMN last_modified VARCHAR NULL")
+        cur.execute("ALTER TABLE feeds ADD COLUMN content_hash VARCHAR(64) NULL")
+        version += 1
+
+    if version == 3:
+        # the date articles are delivered by, indexed with their feed so
+        # finding articles for delivery is a range scan of one feed
+        cur.execute("ALTER TABLE articles ADD COLUMN effective_at DATETIME "
+                    "GENERATED ALWAYS AS (COALESCE(published_at, created_at)) VIRTUAL")
+        cur.execute(
+            "CREATE INDEX articles_feed_id_effective_at ON articles(feed_id, effective_at)")
+        cur.execute(
+            "CREATE INDEX subscriptions_feed_id ON subscriptions(feed_id)")
+        version += 1
+
+    if version == 4:
+        # rendered messages waiting to be sent. status is one of
+        # pending, sent or dead once it ran out of attempts
+        outbox_table = ("CREATE TABLE outbox("
+                        "message_id INTEGER PRIMARY KEY NOT NULL,"
+                        "subscription_id INTEGER NULL,"
+                        "email VARCHAR(155) NOT NULL,"
+                        "subject VARCHAR(155) NOT NULL,"
+                        "content TEXT NOT NULL,"
+                        "content_type VARCHAR(10) NOT NULL,"
+                        "status VARCHAR(10) NOT NULL DEFAULT 'pending',"
+                        "attempts INTEGER NOT NULL DEFAULT 0,"
+                        "last_error TEXT NULL,"
+                        "next_attempt_at DATETIME NULL,"
+                        "created_at DATETIME,"
+                        "sent_at DATETIME NULL,"
+                        "FOREIGN KEY(subscription_id) REFERENCES subscriptions(subscription_id)"
+                        ");")
+
+        cur.execute(outbox_table)
+        cur.execute(
+            "CREATE INDEX outbox_status_next_attempt_at ON outbox(status, next_attempt_at)")
+        version += 1
+
+    if version == 5:
+        # seconds between refreshes and deliveries when running as a
+        # daemon, NULL uses the configured default
+        cur.execute(
+            "ALTER TABLE feeds ADD COLUMN refresh_interval INTEGER NULL")
+        cur.execute(
+            "ALTER TABLE subscriptions ADD COLUMN delivery_interval INTEGER NULL")
+        version += 1
+
+    if version == 6:
+        # state used to work out when each feed is next due
+        cur.execute("ALTER TABLE feeds ADD COLUMN next_refresh_at DATETIME NULL")
+        cur.execute(
+            "ALTER TABLE feeds ADD COLUMN empty_refreshes INTEGER NOT NULL DEFAULT 0")
+        cur.execute(
+            "ALTER TABLE feeds ADD COLUMN failed_refreshes INTEGER NOT NULL DEFAULT 0")
+        cur.execute("ALTER TABLE feeds ADD COLUMN hint_interval INTEGER NULL")
+
+        # status is one of ok, not_modified or error
+        feed_refreshes_table = ("CREATE TABLE feed_refreshes("
+                                "refresh_id INTEGER PRIMARY KEY NOT NULL,"
+                                "feed_id INTEGER NOT NULL,"
+                                "status VARCHAR(12) NOT NULL,"
+                                "new_articles INTEGER NOT NULL DEFAULT 0,"
+                                "refreshed_at DATETIME,"
+                                "FOREIGN KEY(feed_id) REFERENCES feeds(feed_id)"
+                                ");")
+
+        cur.execute(feed_refreshes_table)
+        cur.execute(
+            "CREATE INDEX feed_refreshes_feed_id ON feed_refreshes(feed_id, refresh_id)")
+        version += 1
+
+    if version == 7:
+        # identity of an article shared by its copies in other feeds and
+        # at other urls, NULL for articles stored before it was added
+        cur.execute("ALTER TABLE articles ADD COLUMN guid VARCHAR NULL")
+        cur.execute(
+            "CREATE UNIQUE INDEX articles_feed_id_guid ON articles(feed_id, guid)")
+        cur.execute("CREATE INDEX articles_guid ON articles(guid)")
+        version += 1
+
+    if version == 8:
+        # rendered subjects and contents of articles shared between the
+        # subscribers of a feed. template includes a hash of its source so
+        # renders of an older template are never used
+        rendered_articles_table = ("CREATE TABLE rendered_articles("
+                                   "article_id INTEGER NOT NULL,"
+                                   "template VARCHAR NOT NULL,"
+                                   "content_type VARCHAR(10) NOT NULL,"
+                                   "desc_length INTEGER NULL,"
+                                   "subject VARCHAR NOT NULL,"
+                                   "content TEXT NOT NULL,"
+                                   "created_at DATETIME,"
+                                   "PRIMARY KEY(article_id, template, content_type, desc_length),"
+                                   "FOREIGN KEY(article_id) REFERENCES articles(article_id)"
+                                   ");")
+
+        cur.execute(rendered_articles_table)
+        version += 1
+
+    if version == 9:
+        # feeds claimed by a refresh worker until expires_at, so workers
+        # running at the same time never refresh the same feed
+        feed_leases_table = ("CREATE TABLE feed_leases("
+                             "feed_id INTEGER PRIMARY KEY,"
+                             "worker_id VARCHAR NOT NULL,"
+                             "expires_at DATETIME NOT NULL,"
+                             "FOREIGN KEY(feed_id) REFERENCES feeds(feed_id)"
+                             ");")
+
+        cur.execute(feed_leases_table)
+        version += 1
+
+    if version == 10:
+        # when the daemon last looked for articles to deliver to a
+        # subscription, whether or not there were any
+        cur.execute(
+            "ALTER TABLE subscriptions ADD COLUMN checked_delivery_at DATETIME NULL")
+        version += 1
+
+    if version == 11:
+        # url and guid of every pruned article, so entries a feed still
+        # lists are not stored and delivered again once pruned
+        pruned_articles_table = ("CREATE TABLE pruned_articles("
+                                 "feed_id INTEGER NOT NULL,"
+                                 "url VARCHAR(200) NOT NULL,"
+                                 "guid VARCHAR NULL,"
+                                 "pruned_at DATETIME,"
+                                 "FOREIGN KEY(feed_id) REFERENCES feeds(feed_id),"
+                                 "UNIQUE(feed_id, url)"
+                                 ");")
+
+        cur.execute(pruned_articles_table)
+        cur.execute(
+            "CREATE INDEX pruned_articles_feed_id_guid ON pruned_articles(feed_id, guid)")
+        version += 1
+
+    if version == 12:
+        # guids which are only unique within their feed are prefixed with
+        # it. Canonical urls always have a path, so guids without a slash
+        # are ids of the feed or content hashes
+        for table in ('articles', 'pruned_articles'):
+            cur.execute(f"UPDATE {table} SET guid = feed_id || ':' || guid "
+                        "WHERE guid IS NOT NULL AND guid NOT LIKE 'urn:%' AND guid NOT LIKE 'tag:%' "
+                        "AND INSTR(guid, '/') = 0")
+        version += 1
+
+    if version == 13:
+        # the newest article queued for a subscription. Articles stored
+        # after it are delivered next, however long ago they were
+        # published. Existing subscriptions start before the first
+        # article still waiting for them
+        cur.execute("ALTER TABLE subscriptions ADD COLUMN delivered_article_id INTEGER NOT NULL DEFAULT 0")
+        cur.execute("UPDATE subscriptions SET delivered_article_id = COALESCE("
+                    "(SELECT MIN(a.article_id) - 1 FROM articles a WHERE a.feed_id = subscriptions.feed_id "
+                    "AND a.effective_at > COALESCE(subscriptions.attempted_delivery_at, subscriptions.created_at)), "
+                    "(SELECT MAX(a.article_id) FROM articles a WHERE a.feed_id = subscriptions.feed_id), 0)")
+        # the rowid after feed_id lets deliveries seek past the article
+        # delivered last
+        cur.execute("CREATE INDEX articles_feed_id ON articles(feed_id)")
+        version += 1
+
+    if version == 14:
+        # renders of whole descriptions were stored with a NULL
+        # desc_length, which never conflicts in a primary key so every
+        # save added another row. Renders are only a cache, so the table
+        # is recreated with -1 standing for no limit
+        cur.execute("DROP TABLE rendered_articles")
+        cur.execute("CREATE TABLE rendered_articles("
+                    "article_id INTEGER NOT NULL,"
+                    "template VARCHAR NOT NULL,"
+                    "content_type VARCHAR(10) NOT NULL,"
+                    "desc_length INTEGER NOT NULL,"
+                    "subject VARCHAR NOT NULL,"
+                    "content TEXT NOT NULL,"
+                    "created_at DATETIME,"
+                    "PRIMARY KEY(article_id, template, content_type, desc_length),"
+                    "FOREIGN KEY(article_id) REFERENCES articles(article_id)"
+                    ");")
+        version += 1
+
     cur.execute("PRAGMA user_version={v:d}".format(v=version))
 
     conn.commit()
     cur.close()
+
+
+# Switch the database to incremental auto_vacuum so pages freed by
+# deleting rows can be returned to the filesystem without rebuilding the
+# whole file. Changing the mode of an existing database needs one full
+# VACUUM. Returns whether the mode was changed.
+def enable_incremental_vacuum(conn: sqlite3.Connection) -> bool:
+    cur = conn.cursor()
+    cur.execute("PRAGMA auto_vacuum")
+
+    # 2 is incremental
+    if cur.fetchone()['auto_vacuum'] == 2:
+        cur.close()
+        return False
+
+    conn.commit()
+    cur.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    cur.execute("VACUUM")
+    cur.close()
+
+    return True
+
+
+# Return free pages to the filesystem, only has an effect once
+# incremental auto_vacuum is enabled
+def incremental_vacuum(conn: sqlite3.Connection):
+    conn.commit()
+
+    # the pragma frees one page per step, executescript runs it to the end
+    # where execute would only free the first page
+    conn.executescript("PRAGMA incremental_vacuum;")
+
+
+# Rebuild the database file, dropping free pages and defragmenting tables
+# and indexes
+def vacuum(conn: sqlite3.Connection):
+    conn.commit()
+    conn.execute("VACUUM")
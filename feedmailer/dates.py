@@ -0,0 +1,94 @@
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+import re
+from typing import Optional
+
+# Feeds repeat the same timestamps on every refresh, so parsed strings
+# are remembered
+PARSE_CACHE_SIZE = 4096
+
+# "Mon, 01 Jan 2024 10:00:00 +0000", with the weekday, seconds and zone
+# being optional. Zone names other than utc are left to dateutil, which
+# treats ones such as EST as unknown.
+RFC822_DATE = re.compile(
+    r'^(?:[A-Za-z]{3},\s*)?\d{1,2}\s+[A-Za-z]{3}\s+\d{4}\s+\d{1,2}:\d{2}(?::\d{2})?'
+    r'(?:\s+(?:[+-]\d{4}|UTC?|GMT|Z))?$', re.IGNORECASE)
+
+# "2024-01-01", "2024-01-01T10:00:00Z" and "2024-01-01 10:00:00.123+02:00"
+ISO8601_DATE = re.compile(
+    r'^\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}:?\d{2})?)?$')
+
+
+def parse_rfc822(value: str) -> Optional[datetime]:
+    if not RFC822_DATE.match(value):
+        return None
+
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    # -0000 means utc with the local time unknown, which email leaves naive
+    if parsed.tzinfo is None and value.endswith('-0000'):
+        parsed = parsed.replace(tzinfo=timezone.utc)
+
+    return parsed
+
+
+def parse_iso8601(value: str) -> Optional[datetime]:
+    if not ISO8601_DATE.match(value):
+        return None
+
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+# Parse a date as found in a feed. The common RFC 822 and ISO 8601 formats
+# are parsed directly, anything else is left to dateutil. None is
+# returned when it can't make sense of it either, as feedparser does.
+# Dates without a zone are taken to be utc, as feedparser does, rather
+# than the local time of the host storing them.
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_date(value: str) -> Optional[datetime]:
+    value = value.strip()
+    parsed = parse_rfc822(value) or parse_iso8601(value)
+
+    if parsed is None:
+        from dateutil import parser
+
+        try:
+            parsed = parser.parse(value)
+        except (ValueError, OverflowError):
+            return None
+
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+
+    return parsed
+
+
+def from_struct_time(parsed) -> datetime:
+    return datetime(*parsed[:6], tzinfo=timezone.utc)
+
+
+# Time an entry was published. feedparser already parsed the dates it
+# understood into utc struct_times, the entry's own strings are only
+# parsed when it couldn't. Entries without a date which can be parsed
+# are dated by when they were stored.
+def entry_published(entry) -> Optional[datetime]:
+    for key in ('published', 'updated'):
+        parsed = entry.get(key + '_parsed')
+
+        if parsed:
+            return from_struct_time(parsed)
+
+        if entry.get(key):
+            parsed = parse_date(entry[key])
+
+            if parsed:
+                return parsed
+
+    return None
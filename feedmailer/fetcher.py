@@ -0,0 +1,201 @@
+import concurrent.futures
+import contextlib
+from dataclasses import dataclass
+import hashlib
+import itertools
+import tempfile
+import threading
+import time
+from typing import TYPE_CHECKING, BinaryIO, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+import urllib.error
+import urllib.request
+
+import feedparser
+
+from .types import Feed
+
+if TYPE_CHECKING:
+    from .workers import ParsedFeed
+
+USER_AGENT = 'feedmailer'
+CHUNK_SIZE = 64 * 1024
+
+
+@dataclass
+class FetchResult:
+    feed: Feed
+    data: Optional[feedparser.FeedParserDict]
+    error: Optional[Exception]
+    # False when the server answered 304 or the body is unchanged,
+    # in which case data is None and nothing needs to be stored
+    modified: bool = True
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_hash: Optional[str] = None
+    # set instead of data for feeds larger than the stream threshold,
+    # which are left to be parsed incrementally by the caller
+    body: Optional[BinaryIO] = None
+    # measurements of the request. parse_time is left at 0 for streamed
+    # feeds, which are parsed by the caller
+    status: Optional[int] = None
+    size: int = 0
+    fetch_time: float = 0.0
+    parse_time: float = 0.0
+    # when parsing is left to worker processes, the downloaded feed and
+    # the headers it is parsed with in place of data, then the articles
+    # converted from it
+    content: Optional[bytes] = None
+    response_headers: Optional[dict] = None
+    parsed: Optional['ParsedFeed'] = None
+
+
+class HostLimiter():
+    """Caps how many requests may be in flight to a single host at once"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.semaphores = {}
+
+    def get(self, url: str) -> threading.BoundedSemaphore:
+        host = urlparse(url).netloc.lower()
+
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.limit)
+
+            return self.semaphores[host]
+
+
+# Copy a response into a file which is kept in memory until it grows
+# past max_size. The content is hashed along the way.
+def spool(response, max_size: int) -> Tuple[BinaryIO, str, int]:
+    body = tempfile.SpooledTemporaryFile(max_size=max_size)
+    digest = hashlib.sha256()
+    size = 0
+
+    while chunk := response.read(CHUNK_SIZE):
+        digest.update(chunk)
+        body.write(chunk)
+        size += len(chunk)
+
+    body.seek(0)
+
+    return body, digest.hexdigest(), size
+
+
+# feedparser looks headers up by their lowercase names, such as
+# content-type for the charset of the feed
+def lowercase_headers(headers) -> dict:
+    return {name.lower(): value for name, value in headers.items()}
+
+
+# Conditionally request a feed using the validators stored from the
+# previous refresh. The feed is only parsed when its content changed.
+# Feeds larger than stream_threshold bytes are not parsed here but
+# returned as a body to be streamed, None never streams. Without parse
+# the downloaded content is returned to be parsed elsewhere.
+def fetch(feed: Feed, timeout: float, stream_threshold: Optional[int] = None, parse: bool = True) -> FetchResult:
+    headers = {'User-Agent': USER_AGENT}
+
+    if feed.etag:
+        headers['If-None-Match'] = feed.etag
+
+    if feed.last_modified:
+        headers['If-Modified-Since'] = feed.last_modified
+
+    request = urllib.request.Request(feed.url, headers=headers)
+    started = time.perf_counter()
+
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            body, content_hash, size = spool(response, stream_threshold or 0)
+            response_headers = response.headers
+            status = response.status
+    except urllib.error.HTTPError as e:
+        if e.code != 304:
+            raise
+
+        return FetchResult(
+            feed=feed,
+            data=None,
+            error=None,
+            modified=False,
+            etag=e.headers.get('ETag', feed.etag),
+            last_modified=e.headers.get(
+                'Last-Modified', feed.last_modified),
+            content_hash=feed.content_hash,
+            status=e.code,
+            fetch_time=time.perf_counter() - started
+        )
+
+    fetch_time = time.perf_counter() - started
+
+    result = FetchResult(
+        feed=feed,
+        data=None,
+        error=None,
+        modified=content_hash != feed.content_hash,
+        etag=response_headers.get('ETag'),
+        last_modified=response_headers.get('Last-Modified'),
+        content_hash=content_hash,
+        status=status,
+        size=size,
+        fetch_time=fetch_time
+    )
+
+    if result.modified and stream_threshold and size > stream_threshold:
+        result.body = body
+        return result
+
+    with body:
+        if result.modified and not parse:
+            result.content = body.read()
+            result.response_headers = lowercase_headers(response_headers)
+        elif result.modified:
+            started = time.perf_counter()
+            result.data = feedparser.parse(
+                body.read(), response_headers=lowercase_headers(response_headers))
+            result.parse_time = time.perf_counter() - started
+
+    return result
+
+
+def fetch_feed(feed: Feed, timeout: float, limiter: Optional[HostLimiter] = None, stream_threshold: Optional[int] = None, parse: bool = True) -> FetchResult:
+    with limiter.get(feed.url) if limiter else contextlib.nullcontext():
+        # time spent waiting on the host limit is not part of the fetch
+        started = time.perf_counter()
+
+        try:
+            return fetch(feed, timeout, stream_threshold, parse)
+        except Exception as e:
+            return FetchResult(feed=feed, data=None, error=e,
+                               status=getattr(e, 'code', None),
+                               fetch_time=time.perf_counter() - started)
+
+
+# Order feeds so consecutive requests go to different hosts. This keeps
+# workers from queueing up behind the per host limit of a single slow host.
+def interleave_hosts(feeds: List[Feed]) -> List[Feed]:
+    by_host = {}
+
+    for f in feeds:
+        by_host.setdefault(urlparse(f.url).netloc.lower(), []).append(f)
+
+    rounds = itertools.zip_longest(*by_host.values())
+
+    return [f for r in rounds for f in r if f is not None]
+
+
+# Fetch and parse feeds using a pool of threads. Results are yielded
+# as they complete so they can be stored from the calling thread.
+def fetch_feeds(feeds: List[Feed], concurrency: int, host_concurrency: int, timeout: float, stream_threshold: Optional[int] = None, parse: bool = True) -> Iterator[FetchResult]:
+    limiter = HostLimiter(host_concurrency)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        futures = [executor.submit(fetch_feed, f, timeout, limiter, stream_threshold, parse)
+                   for f in interleave_hosts(feeds)]
+
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
@@ -0,0 +1,77 @@
+import hashlib
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# query parameters added for tracking which never change what a url
+# points at
+TRACKING_PARAMS = ('fbclid', 'gclid', 'yclid', 'mc_cid', 'mc_eid', '_ga')
+TRACKING_PREFIXES = ('utm_',)
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# schemes of ids which are unique across feeds, besides urls
+GLOBAL_ID_PREFIXES = ('urn:', 'tag:')
+
+
+def is_tracking_param(name: str) -> bool:
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+# Reduce the variants of a url which point at the same page to one form.
+# The scheme, a leading www, default ports, tracking parameters and
+# trailing slashes are dropped and the remaining query parameters
+# sorted. Fragments are kept, as feeds such as changelogs link every
+# entry to its own fragment of one page.
+def canonical_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+
+    host = (parts.hostname or '').lower()
+
+    if host.startswith('www.'):
+        host = host[4:]
+
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+
+    if port and port != DEFAULT_PORTS.get(parts.scheme.lower()):
+        host += f":{port}"
+
+    path = parts.path.rstrip('/') or '/'
+    query = urlencode(sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                             if not is_tracking_param(k)))
+
+    return urlunsplit(('', host, path, query, parts.fragment)).lstrip('/')
+
+
+def content_hash(title: str, description: str) -> str:
+    content = ' '.join(f"{title}\n{description}".split())
+    return 'sha256:' + hashlib.sha256(content.encode()).hexdigest()
+
+
+# Identity of an entry shared by every copy of it, whichever feed or url
+# variant it was found through. This is the entry's id when it has one,
+# otherwise its canonical url and as a last resort a hash of its content.
+# Ids which are urls are canonicalized too, since feeds often use the
+# link of an entry as its id. Only urls and urn: or tag: ids are unique
+# everywhere, other ids such as "42" are only unique within their feed so
+# are prefixed with feed_id to never match an entry of another feed.
+def article_guid(entry, feed_id: int) -> str:
+    entry_id = (entry.get('id') or '').strip()
+
+    if entry_id:
+        if entry_id.lower().startswith(('http://', 'https://')):
+            return canonical_url(entry_id)
+
+        if entry_id.lower().startswith(GLOBAL_ID_PREFIXES):
+            return entry_id
+
+        return f"{feed_id}:{entry_id}"
+
+    link = (entry.get('link') or '').strip()
+
+    if link:
+        return canonical_url(link)
+
+    return f"{feed_id}:" + content_hash(entry.get('title', ''), entry.get('description', ''))
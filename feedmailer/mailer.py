@@ -2,11 +2,41 @@ from email.message import EmailMessage
 from email.headerregistry import Address
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from jinja2 import Template
+import hashlib
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 import smtplib
+import time
+from typing import Optional, Tuple
+
+
+# Templates are compiled once per environment and kept in memory. With a
+# cache_dir the compiled bytecode is also stored on disk, so later runs
+# can skip compiling them.
+def create_template_env(template_dir: str, cache_dir: Optional[str] = None) -> Environment:
+    bytecode_cache = None
+
+    if cache_dir:
+        bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+    return Environment(
+        loader=FileSystemLoader(template_dir),
+        bytecode_cache=bytecode_cache,
+        auto_reload=False
+    )
+
+
+# Whether an smtp error means the connection to the server is gone.
+# Servers answer 421 when they close a session, often once too many
+# messages were sent over it.
+def is_disconnect(e: Exception) -> bool:
+    return isinstance(e, smtplib.SMTPServerDisconnected) or getattr(e, 'smtp_code', None) == 421
 
 
 class Mailer:
+    """Sends messages over a single smtp session which is opened on the
+    first send and reused until closed. Use it as a context manager so
+    the session is closed once delivering is done."""
+
     def __init__(self, **kwargs):
         self.host = kwargs['host']
         self.user = kwargs['user']
@@ -14,75 +44,185 @@ class Mailer:
         self.auth = kwargs['auth']
         self.ssl = kwargs['ssl']
         self.port = kwargs['port']
-        self.to_email = kwargs['to_email']
+        self.to_email = kwargs.get('to_email', None)
+        self.templates = kwargs.get('templates', None)
+        # reconnect after this many messages, 0 means never
+        self.max_messages = kwargs.get('max_messages', 0)
+        # a feedmailer.metrics.RunMetrics to record latencies into
+        self.metrics = kwargs.get('metrics', None)
+        # a feedmailer.render_cache.RenderCache shared by every render
+        self.render_cache = kwargs.get('render_cache', None)
+        self.template_versions = {}
+        self.connection = None
+        self.num_sent = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def connect(self):
+        constructor = smtplib.SMTP
 
-    def send_article(self, **kwargs):
+        if self.ssl:
+            constructor = smtplib.SMTP_SSL
+
+        started = time.perf_counter()
+        self.connection = constructor(host=self.host, port=self.port)
+        self.num_sent = 0
+
+        if self.auth:
+            self.connection.login(self.user, self.password)
+
+        if self.metrics:
+            self.metrics.observe('smtp_connect', time.perf_counter() - started)
+
+    def close(self):
+        if not self.connection:
+            return
+
+        try:
+            self.connection.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+
+        self.connection = None
+
+    # Name of a template along with a hash of its source, which changes
+    # whenever the template is edited
+    def template_version(self, name: str) -> str:
+        if name not in self.template_versions:
+            source = self.templates.loader.get_source(self.templates, name)[0]
+            self.template_versions[name] = name + '@' + \
+                hashlib.sha1(source.encode()).hexdigest()[:12]
+
+        return self.template_versions[name]
+
+    # Articles are rendered the same way for every subscriber asking for
+    # the same template and description length, so with a render cache
+    # each is rendered once
+    def render_article(self, **kwargs) -> Tuple[str, str]:
+        if not self.render_cache:
+            return self.render_article_uncached(**kwargs)
+
+        key = (
+            kwargs['article'].article_id,
+            self.template_version(kwargs['template']),
+            kwargs.get('content_type', ''),
+            kwargs['desc_length']
+        )
+
+        rendered = self.render_cache.get(key)
+
+        if rendered is None:
+            rendered = self.render_article_uncached(**kwargs)
+            self.render_cache.put(key, rendered)
+
+        return rendered
+
+    def render_article_uncached(self, **kwargs) -> Tuple[str, str]:
         feed_title = kwargs['feed_title']
         article = kwargs['article']
-        content_type = kwargs['content_type']
-        template_file = kwargs['template']
+        template = self.templates.get_template(kwargs['template'])
         desc_length = kwargs['desc_length']
 
-        with open(template_file) as f:
-            template = Template(f.read())
-
-            subject = feed_title + ' - ' + article['title']
-
-            content = template.render(
-                article=article,
-                feed_title=feed_title,
-                desc_length=desc_length
+        subject = feed_title + ' - ' + article.title
 
-            )
+        content = template.render(
+            article=article,
+            feed_title=feed_title,
+            desc_length=desc_length
+        )
 
-            max_length = 80
+        max_length = 80
 
-            self.send(
-                subject[:max_length],
-                content,
-                content_type
-            )
+        return subject[:max_length], content
 
-    def send_digest(self, **kwargs):
+    def render_digest(self, **kwargs) -> Tuple[str, str]:
         feed_title = kwargs['feed_title']
         articles = kwargs['articles']
-        content_type = kwargs['content_type']
-        template_file = kwargs['template']
+        template = self.templates.get_template(kwargs['template'])
         desc_length = kwargs['desc_length']
 
-        with open(template_file) as f:
-            template = Template(f.read())
+        content = template.render(
+            articles=articles,
+            feed_title=feed_title,
+            desc_length=desc_length
+        )
+
+        return feed_title + ' Digest', content
+
+    # One digest made of the digests of several feeds. Each digest has a
+    # feed_title, articles and desc_length.
+    def render_combined_digest(self, **kwargs) -> Tuple[str, str]:
+        digests = kwargs['digests']
+        template = self.templates.get_template(kwargs['template'])
+
+        content = template.render(digests=digests)
+
+        if len(digests) == 1:
+            return digests[0]['feed_title'] + ' Digest', content
+
+        subject = f"Digest of {len(digests)} feeds: " + \
+            ', '.join(d['feed_title'] for d in digests)
 
-            content = template.render(
-                articles=articles,
-                feed_title=feed_title,
-                desc_length=desc_length
-            )
+        max_length = 80
+
+        return subject[:max_length], content
+
+    def send_article(self, **kwargs):
+        subject, content = self.render_article(**kwargs)
 
         self.send(
-            feed_title + ' Digest',
+            subject,
             content,
-            content_type
+            kwargs['content_type'],
+            kwargs.get('to_email', self.to_email)
         )
 
-    def send(self, subject, content, content_type='plain'):
-        constructor = smtplib.SMTP
+    def send_digest(self, **kwargs):
+        subject, content = self.render_digest(**kwargs)
 
-        if self.ssl:
-            constructor = smtplib.SMTP_SSL
+        self.send(
+            subject,
+            content,
+            kwargs['content_type'],
+            kwargs.get('to_email', self.to_email)
+        )
+
+    def send(self, subject, content, content_type='plain', to_email=None):
+        msg = MIMEMultipart('alternative')
+        msg['From'] = self.user
+        msg['To'] = to_email or self.to_email
+        msg['Subject'] = subject
+
+        part = MIMEText(content, content_type)
+
+        msg.attach(part)
+        msg.set_default_type(content_type)
+
+        if self.connection and self.max_messages and self.num_sent >= self.max_messages:
+            self.close()
+
+        if not self.connection:
+            self.connect()
 
-        with constructor(host=self.host, port=self.port) as s:
-            if self.auth:
-                s.login(self.user, self.password)
+        started = time.perf_counter()
 
-            msg = MIMEMultipart('alternative')
-            msg['From'] = self.user
-            msg['To'] = self.to_email
-            msg['Subject'] = subject
+        try:
+            self.connection.send_message(msg)
+        except smtplib.SMTPException as e:
+            if not is_disconnect(e):
+                raise
 
-            part = MIMEText(content, content_type)
+            # the server dropped the session, retry once on a new one
+            self.close()
+            self.connect()
+            started = time.perf_counter()
+            self.connection.send_message(msg)
 
-            msg.attach(part)
-            msg.set_default_type(content_type)
+        if self.metrics:
+            self.metrics.observe('smtp_send', time.perf_counter() - started)
 
-            s.send_message(msg)
+        self.num_sent += 1
@@ -0,0 +1,164 @@
+from datetime import datetime, timezone
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+FORMATS = ('prometheus', 'jsonl')
+
+JSONL_FILE = 'runs.jsonl'
+
+# per feed values written as feedmailer_feed_<name>
+FEED_METRICS = {
+    'http_status': 'HTTP status of the last response',
+    'bytes': 'Bytes downloaded',
+    'fetch_seconds': 'Seconds taken to download',
+    'parse_seconds': 'Seconds taken to parse',
+    'convert_seconds': 'Seconds taken converting entries to articles',
+    'new_articles': 'New articles found',
+    'error': '1 when the feed could not be fetched'
+}
+
+
+class RunMetrics():
+    """Measurements taken during one refresh or deliver run. Values may
+    be recorded from several threads at once."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.lock = threading.Lock()
+        self.feeds = {}
+        # seconds spent in each stage of the run
+        self.stages = {}
+        self.counts = {}
+        # individual observations, such as the latency of every smtp send
+        self.timings = {}
+
+    def set_feed(self, feed_id: int, **values):
+        with self.lock:
+            self.feeds.setdefault(feed_id, {}).update(values)
+
+    def add_time(self, stage: str, seconds: float):
+        with self.lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def count(self, name: str, n: int = 1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def observe(self, name: str, seconds: float):
+        with self.lock:
+            self.timings.setdefault(name, []).append(seconds)
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.started
+
+    def summarize_timings(self) -> Dict[str, Dict[str, float]]:
+        return {name: {'count': len(values), 'sum': sum(values), 'max': max(values)}
+                for name, values in self.timings.items()}
+
+    def to_dict(self) -> dict:
+        return {
+            'run': self.name,
+            'started_at': datetime.fromtimestamp(self.started_at, timezone.utc).isoformat(),
+            'duration': self.duration,
+            'stages': self.stages,
+            'counts': self.counts,
+            'timings': self.summarize_timings(),
+            'feeds': [dict(feed_id=feed_id, **values) for feed_id, values in self.feeds.items()]
+        }
+
+
+# Total seconds spent in each phase of a run. Feeds are fetched and mail
+# is sent from several threads at once, so phases can add up to more
+# than the duration of the run.
+def phase_times(run: RunMetrics) -> Dict[str, float]:
+    phases = {}
+
+    if run.feeds:
+        for key, phase in (('fetch_seconds', 'fetch'), ('parse_seconds', 'parse'), ('convert_seconds', 'entry_to_article')):
+            phases[phase] = sum(values.get(key) or 0.0 for values in run.feeds.values())
+
+    phases.update(run.stages)
+
+    for name, values in run.timings.items():
+        phases[name] = sum(values)
+
+    return phases
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(**labels) -> str:
+    return ','.join(f'{k}="{escape_label(v)}"' for k, v in labels.items())
+
+
+def metric_lines(name: str, kind: str, description: str, samples: List[tuple]) -> List[str]:
+    if not samples:
+        return []
+
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+    lines += [f"{name}{suffix}{{{labels}}} {value!r}" for suffix,
+              labels, value in samples]
+
+    return lines
+
+
+def to_prometheus(run: RunMetrics) -> str:
+    run_label = format_labels(run=run.name)
+    timings = run.summarize_timings()
+
+    lines = metric_lines('feedmailer_run_duration_seconds', 'gauge', 'Seconds taken by the last run',
+                         [('', run_label, run.duration or 0.0)])
+    lines += metric_lines('feedmailer_run_timestamp_seconds', 'gauge', 'Unix time the last run started',
+                          [('', run_label, run.started_at)])
+    lines += metric_lines('feedmailer_run_stage_seconds', 'gauge', 'Seconds spent in each stage of the last run',
+                          [('', format_labels(run=run.name, stage=stage), seconds) for stage, seconds in run.stages.items()])
+
+    for name, value in run.counts.items():
+        lines += metric_lines(f"feedmailer_{name}", 'gauge', f"Number of {name.replace('_', ' ')} in the last run",
+                              [('', run_label, value)])
+
+    for name, summary in timings.items():
+        lines += metric_lines(f"feedmailer_{name}_seconds", 'summary', f"Seconds taken by each {name.replace('_', ' ')}",
+                              [('_sum', run_label, summary['sum']), ('_count', run_label, summary['count'])])
+        lines += metric_lines(f"feedmailer_{name}_seconds_max", 'gauge', f"Longest {name.replace('_', ' ')} in seconds",
+                              [('', run_label, summary['max'])])
+
+    for key, description in FEED_METRICS.items():
+        samples = [('', format_labels(feed_id=feed_id, url=values.get('url', '')), values[key])
+                   for feed_id, values in run.feeds.items() if values.get(key) is not None]
+        lines += metric_lines(f"feedmailer_feed_{key}", 'gauge', description, samples)
+
+    return '\n'.join(lines) + '\n'
+
+
+# Replace a file in one step so collectors never read a partial file
+def write_atomic(path: str, content: str):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+
+    with os.fdopen(fd, 'w') as f:
+        f.write(content)
+
+    os.replace(tmp_path, path)
+
+
+# Write the metrics of a run into directory. The prometheus format is
+# written as <run>.prom for the textfile collector of node_exporter,
+# replacing the previous run's, while jsonl appends a line for every run.
+def write(run: RunMetrics, directory: str, formats: List[str]):
+    os.makedirs(directory, exist_ok=True)
+
+    if 'prometheus' in formats:
+        write_atomic(os.path.join(directory, run.name + '.prom'), to_prometheus(run))
+
+    if 'jsonl' in formats:
+        with open(os.path.join(directory, JSONL_FILE), 'a') as f:
+            f.write(json.dumps(run.to_dict()) + '\n')
@@ -0,0 +1,33 @@
+from typing import List, Tuple
+import xml.etree.ElementTree as ET
+
+from .types import Subscription
+
+
+# (title, url) of every feed in an opml document, including ones nested
+# in categories. Feeds listed more than once are only returned the first
+# time. title is None when the outline has none.
+def read_feeds(source) -> List[Tuple[str | None, str]]:
+    feeds = {}
+
+    for outline in ET.parse(source).iter('outline'):
+        url = (outline.get('xmlUrl') or '').strip()
+
+        if url and url not in feeds:
+            feeds[url] = outline.get('title') or outline.get('text') or None
+
+    return [(title, url) for url, title in feeds.items()]
+
+
+def write_feeds(subscriptions: List[Subscription], title: str) -> str:
+    opml = ET.Element('opml', version='2.0')
+    head = ET.SubElement(opml, 'head')
+    ET.SubElement(head, 'title').text = title
+    body = ET.SubElement(opml, 'body')
+
+    for s in subscriptions:
+        ET.SubElement(body, 'outline', type='rss', text=s.title, title=s.title, xmlUrl=s.url)
+
+    ET.indent(opml)
+
+    return ET.tostring(opml, encoding='unicode', xml_declaration=True) + '\n'
@@ -0,0 +1,69 @@
+import concurrent.futures
+import queue
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from .mailer import Mailer
+from .types import Message
+
+
+# Seconds to wait before the next attempt of a message which failed
+# `attempts` times, None once it should no longer be retried.
+def retry_delay(attempts: int, max_attempts: int, backoff: float) -> Optional[float]:
+    if attempts >= max_attempts:
+        return None
+
+    return backoff * 2 ** (attempts - 1)
+
+
+# Send messages until there are none left, then put None on results to
+# tell it is done, including when it failed to connect.
+def send_worker(create_mailer: Callable[[], Mailer], jobs: queue.Queue, results: queue.Queue):
+    try:
+        with create_mailer() as mailer:
+            while True:
+                try:
+                    message = jobs.get_nowait()
+                except queue.Empty:
+                    return
+
+                try:
+                    mailer.send(message.subject, message.content,
+                                message.content_type, message.email)
+                    results.put((message, None))
+                except Exception as e:
+                    results.put((message, e))
+    finally:
+        results.put(None)
+
+
+# Send messages from a pool of workers, each with its own smtp session.
+# Results are yielded as each message is sent or fails so they can be
+# recorded from the calling thread. Messages left once every worker
+# stopped are not yielded, and the error which stopped a worker is
+# raised after the others are done.
+def send_messages(messages: List[Message], create_mailer: Callable[[], Mailer], workers: int) -> Iterator[Tuple[Message, Optional[Exception]]]:
+    jobs = queue.Queue()
+    results = queue.Queue()
+
+    for m in messages:
+        jobs.put(m)
+
+    num_workers = max(min(workers, len(messages)), 1)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(send_worker, create_mailer, jobs, results)
+                   for _ in range(num_workers)]
+
+        running = num_workers
+
+        while running:
+            result = results.get()
+
+            if result is None:
+                running -= 1
+            else:
+                yield result
+
+        # surface errors from connecting and closing the smtp sessions
+        for f in futures:
+            f.result()
@@ -0,0 +1,63 @@
+from collections import OrderedDict
+from sqlite3 import Connection
+from typing import Optional, Tuple
+
+from . import crud
+
+# (article_id, template, content_type, desc_length)
+RenderKey = Tuple[int, str, str, Optional[int]]
+
+
+class RenderCache():
+    """Subjects and contents of rendered articles, so an article sent to
+    several subscribers of its feed is only rendered once for each
+    format. The least recently used renders are dropped once there are
+    more than max_size. With a connection, renders are also looked up in
+    and saved to the database so later runs can reuse them. Not thread
+    safe, rendering happens on the thread which queues messages."""
+
+    def __init__(self, max_size: int, conn: Optional[Connection] = None):
+        self.max_size = max_size
+        self.conn = conn
+        self.entries = OrderedDict()
+        # renders which still need to be saved to the database
+        self.unsaved = []
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: RenderKey) -> Optional[Tuple[str, str]]:
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        if self.conn:
+            rendered = crud.find_rendered_article(self.conn, *key)
+
+            if rendered:
+                self.hits += 1
+                self.remember(key, rendered)
+                return rendered
+
+        self.misses += 1
+        return None
+
+    def put(self, key: RenderKey, rendered: Tuple[str, str]):
+        self.remember(key, rendered)
+
+        if self.conn:
+            self.unsaved.append((*key, *rendered))
+
+    def remember(self, key: RenderKey, rendered: Tuple[str, str]):
+        self.entries[key] = rendered
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    # Save new renders to the database within one transaction
+    def save(self):
+        if self.conn and self.unsaved:
+            crud.store_rendered_articles(self.conn, self.unsaved)
+
+        self.unsaved = []
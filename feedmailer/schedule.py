@@ -0,0 +1,81 @@
+from datetime import datetime
+import statistics
+from typing import List, Optional
+
+UPDATE_PERIODS = {
+    'hourly': 3600,
+    'daily': 86400,
+    'weekly': 604800,
+    'monthly': 2592000,
+    'yearly': 31536000
+}
+
+# how many times more often a feed is polled than it posts
+POLLS_PER_POST = 2
+
+# growth of the interval for every refresh in a row which found nothing,
+# up to MAX_EMPTY_BACKOFF refreshes
+EMPTY_BACKOFF = 1.5
+MAX_EMPTY_BACKOFF = 5
+
+
+# Smallest interval in seconds a feed asks to be polled at, from either
+# its rss ttl or its syndication module update period
+def hint_interval(feed_data) -> Optional[int]:
+    hints = []
+
+    try:
+        hints.append(int(feed_data['ttl']) * 60)
+    except (KeyError, TypeError, ValueError):
+        pass
+
+    period = UPDATE_PERIODS.get(
+        str(feed_data.get('sy_updateperiod', '')).strip().lower())
+
+    if period:
+        try:
+            frequency = max(int(feed_data.get('sy_updatefrequency', 1)), 1)
+        except (TypeError, ValueError):
+            frequency = 1
+
+        hints.append(period // frequency)
+
+    return min(hints) if hints else None
+
+
+# Median seconds between posts of a feed, from the publish times of
+# its most recent articles
+def posting_cadence(publish_times: List[datetime]) -> Optional[float]:
+    times = sorted(publish_times, reverse=True)
+    gaps = [(a - b).total_seconds() for a, b in zip(times, times[1:])]
+    gaps = [g for g in gaps if g > 0]
+
+    return statistics.median(gaps) if gaps else None
+
+
+# Seconds until a feed should be refreshed again. Feeds are polled
+# according to how often they post, backing off while refreshes keep
+# finding nothing new and exponentially after errors. A feed's own ttl
+# hint is never polled faster than.
+def next_refresh_interval(**kwargs) -> int:
+    min_interval = kwargs['min_interval']
+    max_interval = kwargs['max_interval']
+    empty_refreshes = kwargs['empty_refreshes']
+    failed_refreshes = kwargs['failed_refreshes']
+    hint = kwargs['hint']
+    cadence = posting_cadence(kwargs['publish_times'])
+
+    if failed_refreshes:
+        interval = min_interval * 2 ** failed_refreshes
+    else:
+        interval = kwargs['default_interval']
+
+        if cadence:
+            interval = cadence / POLLS_PER_POST
+
+        interval *= EMPTY_BACKOFF ** min(empty_refreshes, MAX_EMPTY_BACKOFF)
+
+    if hint:
+        interval = max(interval, hint)
+
+    return int(min(max(interval, min_interval), max_interval))
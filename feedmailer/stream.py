@@ -0,0 +1,105 @@
+import itertools
+from typing import BinaryIO, Iterable, Iterator, List
+import xml.etree.ElementTree as ET
+
+from feedparser import FeedParserDict
+
+ATOM = '{http://www.w3.org/2005/Atom}'
+RSS1 = '{http://purl.org/rss/1.0/}'
+DC = '{http://purl.org/dc/elements/1.1/}'
+CONTENT = '{http://purl.org/rss/1.0/modules/content/}'
+
+ENTRY_TAGS = ('item', RSS1 + 'item', ATOM + 'entry')
+
+
+def text_of(element: ET.Element) -> str:
+    # xhtml content is made of child elements rather than text
+    if len(element):
+        return ''.join(ET.tostring(child, encoding='unicode') for child in element)
+
+    return (element.text or '').strip()
+
+
+def find_text(element: ET.Element, *tags: str) -> str | None:
+    for tag in tags:
+        child = element.find(tag)
+
+        if child is not None and text_of(child):
+            return text_of(child)
+
+    return None
+
+
+def atom_link(entry: ET.Element) -> str | None:
+    for link in entry.findall(ATOM + 'link'):
+        if link.get('rel', 'alternate') == 'alternate':
+            return link.get('href')
+
+    return None
+
+
+# Build an entry with the same keys feedparser would use so it can be
+# passed to entry_to_article
+def element_to_entry(element: ET.Element) -> FeedParserDict:
+    entry = FeedParserDict()
+
+    if element.tag == ATOM + 'entry':
+        values = {
+            'id': find_text(element, ATOM + 'id'),
+            'title': find_text(element, ATOM + 'title'),
+            'link': atom_link(element),
+            'summary': find_text(element, ATOM + 'summary', ATOM + 'content'),
+            'published': find_text(element, ATOM + 'published'),
+            'updated': find_text(element, ATOM + 'updated'),
+            'author': find_text(element, ATOM + 'author/' + ATOM + 'name')
+        }
+    else:
+        ns = RSS1 if element.tag.startswith(RSS1) else ''
+        values = {
+            'id': find_text(element, 'guid') or element.get('{http://www.w3.org/1999/02/22-rdf-syntax-ns#}about'),
+            'title': find_text(element, ns + 'title'),
+            'link': find_text(element, ns + 'link'),
+            'summary': find_text(element, ns + 'description', CONTENT + 'encoded'),
+            'published': find_text(element, 'pubDate'),
+            'updated': find_text(element, DC + 'date'),
+            'author': find_text(element, 'author', DC + 'creator')
+        }
+
+    for key, value in values.items():
+        if value is not None:
+            entry[key] = value
+
+    entry.setdefault('title', '')
+    entry.setdefault('summary', '')
+
+    return entry
+
+
+# Incrementally parse the entries of an rss or atom document. Each entry
+# is removed from the tree once it has been yielded so memory use does
+# not grow with the size of the feed.
+def iter_entries(fileobj: BinaryIO) -> Iterator[FeedParserDict]:
+    parents = []
+
+    for event, element in ET.iterparse(fileobj, events=('start', 'end')):
+        if event == 'start':
+            parents.append(element)
+            continue
+
+        parents.pop()
+
+        if element.tag in ENTRY_TAGS:
+            entry = element_to_entry(element)
+
+            if parents:
+                parents[-1].remove(element)
+
+            if 'link' in entry:
+                yield entry
+
+
+def iter_batches(iterable: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(iterable)
+
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
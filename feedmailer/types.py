@@ -4,8 +4,9 @@ from typing import Optional, TypedDict
 from datetime import datetime
 
 
-@dataclass
+@dataclass(slots=True)
 class Article:
+    article_id: int
     title: str
     url: str
     author: Optional[str]
@@ -15,9 +16,10 @@ class Article:
     published_at: Optional[datetime]
     created_at: datetime
     updated_at: datetime
+    guid: Optional[str]
 
 
-@dataclass
+@dataclass(slots=True)
 class Feed:
     feed_id: int
     title: str
@@ -25,6 +27,27 @@ class Feed:
     refreshed_at: Optional[datetime]
     updated_at: Optional[datetime]
     url: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    content_hash: Optional[str]
+    refresh_interval: Optional[int]
+    next_refresh_at: Optional[datetime]
+    empty_refreshes: int
+    failed_refreshes: int
+    hint_interval: Optional[int]
+
+
+class FeedRefresh(TypedDict):
+    feed_id: int
+    status: str
+    new_articles: int
+    interval: int
+    empty_refreshes: int
+    failed_refreshes: int
+    hint_interval: Optional[int]
+    etag: Optional[str]
+    last_modified: Optional[str]
+    content_hash: Optional[str]
 
 
 class FeedsFilter(TypedDict):
@@ -33,6 +56,30 @@ class FeedsFilter(TypedDict):
     url: Optional[str]
 
 
+@dataclass(slots=True)
+class Message:
+    message_id: int
+    subscription_id: Optional[int]
+    email: str
+    subject: str
+    content: str
+    content_type: str
+    status: str
+    attempts: int
+    last_error: Optional[str]
+    next_attempt_at: Optional[datetime]
+    created_at: datetime
+    sent_at: Optional[datetime]
+
+
+class NewMessage(TypedDict):
+    subscription_id: Optional[int]
+    email: str
+    subject: str
+    content: str
+    content_type: str
+
+
 class NewSubscription(TypedDict):
     title: str
     url: str
@@ -48,9 +95,10 @@ class NewArticle(TypedDict):
     feed_id: int
     description: Optional[str]
     published_at: Optional[datetime]
+    guid: str
 
 
-@dataclass
+@dataclass(slots=True)
 class Subscription:
     subscription_id: int
     desc_length: Optional[int]
@@ -63,6 +111,7 @@ class Subscription:
     created_at: datetime
     updated_at: Optional[datetime]
     refreshed_at: Optional[datetime]
+    delivery_interval: Optional[int]
 
 
 class SubscriptionsFilter(TypedDict):
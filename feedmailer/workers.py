@@ -0,0 +1,106 @@
+import concurrent.futures
+from dataclasses import dataclass
+import multiprocessing
+import signal
+import time
+from sqlite3 import Connection
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .types import NewArticle
+
+if TYPE_CHECKING:
+    from .fetcher import FetchResult
+
+# read only connection of a worker process, opened by init_worker
+connection: Optional[Connection] = None
+
+
+@dataclass
+class ParsedFeed:
+    articles: List[NewArticle]
+    hint_interval: Optional[int]
+    # entries which were skipped as they are already stored
+    known_entries: int
+    parse_time: float
+    convert_time: float
+    # urls and guids of every entry, when the feed has pruned articles
+    # which are forgotten once it no longer lists them
+    listed: Optional[Tuple[Set[str], Set[str]]] = None
+
+
+# Processes are spawned rather than forked, since feeds are still being
+# fetched on other threads and a forked child could inherit locks they
+# hold. Each worker reads the database at db_location to look up the
+# entries which are already stored.
+def create_pool(workers: int, db_location: str) -> concurrent.futures.ProcessPoolExecutor:
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+        initializer=init_worker, initargs=(db_location,))
+
+
+# Workers ignore SIGINT and SIGTERM sent to the whole process group,
+# leaving it to the parent to finish the feeds in flight and shut the
+# pool down. WAL lets their connections read while the parent writes.
+def init_worker(db_location: str):
+    global connection
+
+    from feedmailer import database
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    connection = database.connect_read_only(db_location)
+
+
+# Parse a downloaded feed and convert the entries which are not already
+# stored into articles. This runs in a worker process so it only takes
+# and returns values which can be pickled.
+def parse_feed(feed_id: int, content: bytes, response_headers: dict) -> ParsedFeed:
+    import feedparser
+    from feedmailer import crud, schedule
+    from feedmailer.commandline import entry_keys, entry_to_article, unknown_entries
+
+    started = time.perf_counter()
+    data = feedparser.parse(content, response_headers=response_headers)
+    converting = time.perf_counter()
+
+    entries = unknown_entries(connection, feed_id, data.entries)
+    articles = [entry_to_article(e, feed_id) for e in entries]
+
+    return ParsedFeed(
+        articles=articles,
+        hint_interval=schedule.hint_interval(data.feed),
+        known_entries=len(data.entries) - len(entries),
+        parse_time=converting - started,
+        convert_time=time.perf_counter() - converting,
+        listed=entry_keys(data.entries, feed_id) if crud.has_pruned_articles(connection, feed_id) else None
+    )
+
+
+# Hand feeds which were downloaded without being parsed to a pool of
+# processes. Other results are passed through straight away and parsed
+# ones once their articles come back, so they can all be stored from the
+# calling thread. A feed whose worker failed is returned with the error.
+def parse_results(pool: concurrent.futures.Executor, results: Iterable['FetchResult']) -> Iterator['FetchResult']:
+    futures = {}
+
+    for r in results:
+        if r.content is None:
+            yield r
+            continue
+
+        future = pool.submit(parse_feed, r.feed.feed_id, r.content,
+                             r.response_headers)
+        futures[future] = r
+        r.content = None
+
+    for future in concurrent.futures.as_completed(futures):
+        r = futures[future]
+
+        try:
+            r.parsed = future.result()
+            r.parse_time = r.parsed.parse_time
+        except Exception as e:
+            r.error = e
+
+        yield r
@@ -16,7 +16,9 @@ setup(
         'data/article.txt.jinja',
         'data/digest.txt.jinja',
         'data/digest.html.jinja',
-        'data/article.html.jinja'
+        'data/article.html.jinja',
+        'data/combined_digest.txt.jinja',
+        'data/combined_digest.html.jinja'
     ]},
     license='GPL3',
     keywords='rss email feeds'